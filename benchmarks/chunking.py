@@ -0,0 +1,114 @@
+"""
+Compare the token-aware TokenChunker against the original chunk_text on
+real PDFs: chunking throughput and retrieval recall@k.
+
+    python -m benchmarks.chunking textbook.pdf [more.pdf ...] --queries 200 --top-k 3
+
+Recall is measured by sampling sentences from each document, using them as
+queries against that document's chunks, and counting a hit when one of the
+top-k chunks contains the sentence. Text past the embedder's 256 word-piece
+window is never embedded, so sentences there are hard to retrieve from the
+1000-character chunks. Run from the repository root with the project's .env.
+"""
+import argparse
+import random
+import re
+import textwrap
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from config import Config
+from src.index_data.chunking import TokenChunker, split_sentences
+from src.index_data.pdf import count_pages, extract_page_range
+
+
+def chunk_text(text, chunk_size=1000, overlap=100):
+    """
+    Split the text into overlapping chunks: the character-based chunker ingestion
+    used before TokenChunker, kept here as the baseline.
+    """
+    chunks = textwrap.wrap(text, chunk_size)
+    overlapped_chunks = []
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            overlapped_chunks.append(chunk)
+        else:
+            overlapped_chunks.append(chunks[i-1][-overlap:] + chunk)
+    return overlapped_chunks
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def run_token_chunker(model, pages):
+    chunker = TokenChunker(
+        model.tokenizer,
+        max_tokens=min(Config.CHUNK_MAX_TOKENS, model.max_seq_length - 2),
+        overlap_tokens=Config.CHUNK_OVERLAP_TOKENS
+    )
+    chunks = []
+    for number, text in enumerate(pages):
+        chunks.extend(chunker.feed(number, text))
+    chunks.extend(chunker.finish())
+    return [chunk.text for chunk in chunks]
+
+
+def recall_at_k(model, chunks, queries, top_k):
+    chunk_vectors = model.encode(chunks, batch_size=64, normalize_embeddings=True)
+    query_vectors = model.encode(queries, batch_size=64, normalize_embeddings=True)
+    normalized_chunks = [normalize(chunk) for chunk in chunks]
+    ranked = np.argsort(-(query_vectors @ chunk_vectors.T), axis=1)[:, :top_k]
+    hits = sum(
+        any(normalize(query) in normalized_chunks[index] for index in row)
+        for query, row in zip(queries, ranked)
+    )
+    return hits / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--queries", type=int, default=200, help="sampled query sentences per document")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = SentenceTransformer(Config.EMBEDDING_MODEL)
+    rng = random.Random(args.seed)
+    for path in args.pdfs:
+        pages = extract_page_range(path, 0, count_pages(path))
+        text = "".join(page + "\n" for page in pages)
+        sentences = [
+            text[start:end] for start, end in split_sentences(text)
+            if len(text[start:end].split()) >= 8
+        ]
+        queries = rng.sample(sentences, min(args.queries, len(sentences)))
+
+        baseline, baseline_seconds = timed(chunk_text, text)
+        token_chunks, token_seconds = timed(run_token_chunker, model, pages)
+
+        megabytes = len(text.encode()) / 1e6
+        print(f"{path}: {len(pages)} pages, {megabytes:.2f} MB of text, {len(queries)} queries")
+        for name, chunks, seconds in (
+            ("chunk_text", baseline, baseline_seconds),
+            ("TokenChunker", token_chunks, token_seconds),
+        ):
+            recall = recall_at_k(model, chunks, queries, args.top_k)
+            print(
+                f"  {name:<13} chunks={len(chunks):6d}  "
+                f"throughput={megabytes / seconds:8.2f} MB/s  "
+                f"recall@{args.top_k}={recall:.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
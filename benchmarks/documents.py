@@ -0,0 +1,164 @@
+"""
+Micro-benchmark of the documents collection: the ad-hoc queries the
+routers used to run against DocumentRepository's indexed, projected ones.
+
+    python -m benchmarks.documents --documents 5000 --selected 20 [--uri mongodb://localhost:27017 | --mongomock]
+
+Both sides run against a throwaway `fyp_benchmark.documents` collection,
+first without any index (as before) and then after ensure_indexes. Each
+operation reports the median time per call, the commands it sent and the
+documents its writes matched. --mongomock runs in-process on mongomock
+(pip install mongomock) instead of a mongod. mongomock ignores indexes on
+reads and checks unique indexes by scanning on writes, so its timings
+favour the unindexed side; compare commands and matched documents there.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import statistics
+import time
+
+from config import Config
+from common.documents import DocumentRepository
+
+
+class MockCollection:
+    """
+    Async facade over a mongomock collection, covering what DocumentRepository calls.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def find(self, *args, **kwargs):
+        async def documents():
+            for document in self.collection.find(*args, **kwargs):
+                yield document
+        return documents()
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class CountingCollection:
+    """
+    Counts the commands sent to a collection and the documents its writes matched.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.commands = 0
+        self.matched = 0
+
+    def find(self, *args, **kwargs):
+        self.commands += 1
+        return self.collection.find(*args, **kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            self.commands += 1
+            result = await method(*args, **kwargs)
+            self.matched += getattr(result, "matched_count", 0) or 0
+            return result
+        return call
+
+
+async def timed(collection: CountingCollection, call, repeat: int):
+    """
+    Return (median ms, commands per call, matched documents per call).
+    """
+    collection.commands = collection.matched = 0
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), collection.commands / repeat, collection.matched / repeat
+
+
+async def legacy_selection(collection, names):
+    await collection.update_many({'name': {'$nin': names}}, {'$set': {'selected': False}})
+    await collection.update_many({'name': {'$in': names}}, {'$set': {'selected': True}})
+
+
+async def legacy_names(collection):
+    return [doc['name'] async for doc in collection.find({}, {'name': 1})]
+
+
+async def legacy_selected(collection):
+    return frozenset([doc['name'] async for doc in collection.find({'selected': True}, {'name': 1})])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default=Config.MONGODB_URI)
+    parser.add_argument("--mongomock", action="store_true")
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--selected", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    client = None
+    if args.mongomock:
+        import mongomock
+        collection = CountingCollection(MockCollection(mongomock.MongoClient()['fyp_benchmark']['documents']))
+    else:
+        from pymongo import AsyncMongoClient
+        client = AsyncMongoClient(args.uri)
+        collection = CountingCollection(client['fyp_benchmark']['documents'])
+    repository = DocumentRepository(collection)
+
+    names = [f"textbook_{i:05d}.pdf" for i in range(args.documents)]
+    await collection.drop()
+    await collection.insert_many([
+        {'name': name, 'content_hash': hashlib.sha256(name.encode()).hexdigest(), 'selected': False}
+        for name in names
+    ])
+    # Alternate between two selections so every call really changes the flags
+    selections = [names[i::max(1, args.documents // args.selected)][:args.selected] for i in range(2)]
+    alternating = itertools.cycle(selections)
+    probe = hashlib.sha256(names[-1].encode()).hexdigest()
+
+    before = {
+        "list names": await timed(collection, lambda: legacy_names(collection), args.repeat),
+        "selected names": await timed(collection, lambda: legacy_selected(collection), args.repeat),
+        "lookup by hash": await timed(
+            collection, lambda: collection.find_one({'content_hash': probe}, {'name': 1}), args.repeat
+        ),
+        "change selection": await timed(
+            collection, lambda: legacy_selection(collection, next(alternating)), args.repeat
+        ),
+    }
+    await repository.ensure_indexes()
+    after = {
+        "list names": await timed(collection, repository.names, args.repeat),
+        "selected names": await timed(collection, repository.selected_names, args.repeat),
+        "lookup by hash": await timed(collection, lambda: repository.find_by_hash(probe), args.repeat),
+        "change selection": await timed(
+            collection, lambda: repository.set_selection(next(alternating)), args.repeat
+        ),
+    }
+    assert await repository.selected_names() in {frozenset(selection) for selection in selections}
+
+    print(f"{args.documents} documents, {args.selected} selected, {'mongomock' if args.mongomock else args.uri}")
+    for operation in before:
+        (before_ms, before_commands, before_matched), (after_ms, after_commands, after_matched) = before[operation], after[operation]
+        print(
+            f"  {operation:<17} before={before_ms:8.3f} ms {before_commands:.0f} cmd {before_matched:6.0f} matched  "
+            f"after={after_ms:8.3f} ms {after_commands:.0f} cmd {after_matched:6.0f} matched"
+        )
+
+    await collection.drop()
+    if client is not None:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
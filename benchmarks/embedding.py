@@ -0,0 +1,85 @@
+"""
+Compare the embedding backends on CPU: PyTorch fp32 (the reference), ONNX
+fp32 and ONNX int8. Reports model load time, batch throughput, single-query
+latency and cosine agreement of each backend's vectors with the reference.
+
+    python -m benchmarks.embedding --texts 2000 --quantization avx2 --threads 4
+
+Texts are the chunks of the retrieval fixture (benchmarks/fixtures/
+retrieval_corpus.json) repeated up to --texts; query latency is measured on
+its queries, one encode call each, as a single retrieval does. The first run
+exports the ONNX models to EMBEDDING_ONNX_DIR. Run from the repository root
+with the project's .env.
+"""
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+import numpy as np
+
+from config import Config
+from common.embedder import load_embedder
+
+FIXTURE = Path(__file__).parent / "fixtures" / "retrieval_corpus.json"
+
+
+def measure(model, texts, queries, batch_size):
+    model.encode(queries[:2], normalize_embeddings=True)  # first call allocates the session's buffers
+    started = time.perf_counter()
+    vectors = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    throughput = len(texts) / (time.perf_counter() - started)
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        model.encode([query], normalize_embeddings=True)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.asarray(vectors, dtype=np.float32), throughput, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=Config.EMBED_BATCH_SIZE)
+    parser.add_argument("--quantization", default=Config.EMBEDDING_QUANTIZATION or "avx2")
+    parser.add_argument("--threads", type=int, default=Config.EMBEDDING_THREADS)
+    args = parser.parse_args()
+
+    fixture = json.loads(FIXTURE.read_text())
+    chunks = [chunk["text"] for chunk in fixture["chunks"]]
+    texts = (chunks * (args.texts // len(chunks) + 1))[:args.texts]
+    queries = [item["query"] for item in fixture["queries"]]
+
+    variants = [
+        ("torch fp32", "torch", ""),
+        ("onnx fp32", "onnx", ""),
+        (f"onnx int8 ({args.quantization})", "onnx", args.quantization),
+    ]
+    print(f"{len(texts)} texts, batch size {args.batch_size}, {len(queries)} queries, threads {args.threads or 'default'}")
+    reference = None
+    for name, backend, quantization in variants:
+        started = time.perf_counter()
+        model = load_embedder(backend, quantization, args.threads)
+        load_seconds = time.perf_counter() - started
+        loaded = getattr(model, "backend", "torch")
+        if loaded != backend:
+            print(f"  {name:<22} skipped: fell back to {loaded}")
+            continue
+
+        vectors, throughput, latencies = measure(model, texts, queries, args.batch_size)
+        if reference is None:
+            reference = vectors
+        # Vectors are unit length, so the row-wise dot product is the cosine similarity
+        agreement = np.sum(vectors * reference, axis=1)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        print(
+            f"  {name:<22} load={load_seconds:6.2f} s  {throughput:8.1f} texts/s  "
+            f"query p50={statistics.median(latencies):6.2f} ms p95={p95:6.2f} ms  "
+            f"cosine mean={agreement.mean():.5f} min={agreement.min():.5f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Fire concurrent /generate_cell_content requests at a running server and
+report whether they overlap.
+
+    python -m benchmarks.load_generate_cell --url http://localhost:8000 --concurrency 8
+
+With a non-blocking request path the wall time stays close to the slowest
+single request; if the event loop is blocked it approaches the sum of all
+request latencies.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def timed_request(client: httpx.AsyncClient, url: str, payload: dict, origin: float):
+    started = time.perf_counter()
+    response = await client.post(f"{url}/generate_cell_content", json=payload)
+    finished = time.perf_counter()
+    response.raise_for_status()
+    return started - origin, finished - origin
+
+
+def overlap_ratio(spans):
+    """
+    Sum of request latencies divided by wall time: ~1 means serial, ~N means fully overlapped.
+    """
+    wall = max(end for _, end in spans) - min(start for start, _ in spans)
+    busy = sum(end - start for start, end in spans)
+    return busy / wall if wall else float("inf")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--topic", default="Linear Regression")
+    parser.add_argument("--type", default="short_paragraph")
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        origin = time.perf_counter()
+        spans = await asyncio.gather(*(
+            timed_request(
+                client, args.url,
+                {"topic": args.topic, "prompt": f"Explain idea #{i} of the topic.", "type": args.type},
+                origin
+            )
+            for i in range(args.concurrency)
+        ))
+
+    for i, (start, end) in sorted(enumerate(spans), key=lambda item: item[1][0]):
+        print(f"request {i:2d}: start={start:6.2f}s end={end:6.2f}s latency={end - start:6.2f}s")
+    wall = max(end for _, end in spans)
+    print(f"wall time:      {wall:.2f}s")
+    print(f"sum latencies:  {sum(end - start for start, end in spans):.2f}s")
+    print(f"overlap ratio:  {overlap_ratio(spans):.2f} (1.00 = fully serial, {args.concurrency}.00 = fully concurrent)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
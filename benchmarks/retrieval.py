@@ -0,0 +1,139 @@
+"""
+Compare dense, BM25 and hybrid (reciprocal-rank fused) retrieval on the
+fixture corpus: recall@k and per-query search latency.
+
+    python -m benchmarks.retrieval --top-k 3 --distractors 50000 [--rerank-model cross-encoder/ms-marco-MiniLM-L-6-v2] [--compact-codec sq8]
+
+The fixture (benchmarks/fixtures/retrieval_corpus.json) mixes prose
+questions with queries on exact identifiers such as np.linalg.norm or
+train_test_split, each labelled with the chunks that answer it. A query
+counts as a hit when one of its relevant chunks is in the top k.
+--distractors adds filler chunks (shuffled fixture words with random
+vectors) so latency can be measured at a realistic index size.
+--compact-codec runs the dense side on CompactVectorStore with that codec
+instead of the float32 FaissVectorStore. Run from the repository root with
+the project's .env.
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from config import Config
+from common.lexical_index import LexicalIndex
+from common.retrieval import reciprocal_rank_fusion
+from common.compact_store import CompactVectorStore
+from common.vector_store import FaissVectorStore
+
+FIXTURE = Path(__file__).parent / "fixtures" / "retrieval_corpus.json"
+
+
+def distractor_chunks(chunks, count, rng):
+    words = [word for chunk in chunks for word in chunk["text"].split()]
+    return [
+        {"id": f"filler#{i}", "filename": "filler.pdf", "text": " ".join(rng.sample(words, 30))}
+        for i in range(count)
+    ]
+
+
+def timed_search(search, queries):
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, latencies
+
+
+def report(name, results, relevant, latencies, top_k):
+    hits = sum(
+        any(match["id"] in wanted for match in matches[:top_k])
+        for matches, wanted in zip(results, relevant)
+    )
+    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+    print(
+        f"  {name:<16} recall@{top_k}={hits / len(relevant):.3f}  "
+        f"p50={statistics.median(latencies):7.2f} ms  p95={p95:7.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--candidates", type=int, default=Config.RETRIEVAL_CANDIDATES)
+    parser.add_argument("--distractors", type=int, default=0)
+    parser.add_argument("--rerank-model", default=Config.RERANK_MODEL)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compact-codec", choices=["flat", "sq8", "pq"])
+    args = parser.parse_args()
+
+    fixture = json.loads(FIXTURE.read_text())
+    chunks = fixture["chunks"]
+    queries = [item["query"] for item in fixture["queries"]]
+    relevant = [set(item["relevant"]) for item in fixture["queries"]]
+    rng = random.Random(args.seed)
+    fillers = distractor_chunks(chunks, args.distractors, rng)
+
+    model = SentenceTransformer(Config.EMBEDDING_MODEL)
+    chunk_vectors = model.encode([chunk["text"] for chunk in chunks], normalize_embeddings=True)
+    filler_vectors = np.random.default_rng(args.seed).standard_normal((len(fillers), chunk_vectors.shape[1]))
+    started = time.perf_counter()
+    query_vectors = model.encode(queries, normalize_embeddings=True)
+    encode_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.compact_codec:
+            store = CompactVectorStore(directory + "/compact", dimension=chunk_vectors.shape[1], codec=args.compact_codec)
+        else:
+            store = FaissVectorStore(directory + "/faiss", dimension=chunk_vectors.shape[1])
+        lexical_index = LexicalIndex(directory + "/lexical")
+        everything = chunks + fillers
+        vectors = np.vstack([chunk_vectors, filler_vectors]) if fillers else chunk_vectors
+        for start in range(0, len(everything), 10000):
+            batch = everything[start:start + 10000]
+            metadata = [{"filename": chunk["filename"], "text": chunk["text"]} for chunk in batch]
+            store.upsert([
+                (chunk["id"], vector.tolist(), meta)
+                for chunk, vector, meta in zip(batch, vectors[start:start + 10000], metadata)
+            ])
+            lexical_index.add([(chunk["id"], meta) for chunk, meta in zip(batch, metadata)])
+        store.flush()
+
+        print(f"{len(everything)} chunks, {len(queries)} queries, query encoding {encode_ms:.2f} ms/query")
+        by_query = dict(zip(queries, query_vectors.tolist()))
+        dense, dense_ms = timed_search(lambda query: store.query(by_query[query], args.candidates), queries)
+        lexical, lexical_ms = timed_search(lambda query: lexical_index.query(query, args.candidates), queries)
+        fused, fused_ms = timed_search(
+            lambda query: reciprocal_rank_fusion([
+                store.query(by_query[query], args.candidates),
+                lexical_index.query(query, args.candidates)
+            ]),
+            queries
+        )
+        report("dense", dense, relevant, dense_ms, args.top_k)
+        report("bm25", lexical, relevant, lexical_ms, args.top_k)
+        report("hybrid (rrf)", fused, relevant, fused_ms, args.top_k)
+
+        if args.rerank_model:
+            reranker = CrossEncoder(args.rerank_model)
+
+            def rerank(query):
+                matches = reciprocal_rank_fusion([
+                    store.query(by_query[query], args.candidates),
+                    lexical_index.query(query, args.candidates)
+                ])
+                scores = reranker.predict([(query, match["metadata"]["text"]) for match in matches])
+                return [matches[index] for index in np.argsort(-scores)]
+
+            reranked, reranked_ms = timed_search(rerank, queries)
+            report("hybrid + rerank", reranked, relevant, reranked_ms, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
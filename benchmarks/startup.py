@@ -0,0 +1,107 @@
+"""
+Measure worker cold start: how long `import main` takes in a fresh
+interpreter, and how long a freshly spawned server takes to answer its
+first request and to report ready, for each WARMUP_MODE.
+
+    python -m benchmarks.startup --runs 5 --modes blocking,background,lazy --path /generate_notebook
+
+Every run starts a new uvicorn process on --port, so nothing is shared
+between runs; times are medians from process spawn. --path should be an
+endpoint that needs neither the embedder nor an external service, such as
+/generate_notebook (POSTed an empty structure) or /cache_stats.
+Run from the repository root with the project's .env.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+EMPTY_NOTEBOOK = {"structure": {"notebook_name": "startup", "cells": []}}
+
+
+def environment(**overrides):
+    env = dict(os.environ, **overrides)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT / "src"), str(ROOT), env.get("PYTHONPATH")]))
+    return env
+
+
+def import_seconds() -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=ROOT, env=environment(), capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def request(client: httpx.Client, url: str, path: str) -> bool:
+    try:
+        if path == "/generate_notebook":
+            response = client.post(url + path, json=EMPTY_NOTEBOOK)
+        else:
+            response = client.get(url + path)
+    except httpx.TransportError:
+        return False
+    return response.status_code == 200
+
+
+def server_run(mode: str, port: int, path: str, timeout: float):
+    """
+    Spawn a server and return (seconds to first 200 on `path`, seconds to /ready).
+    """
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=environment(WARMUP_MODE=mode)
+    )
+    first_response = ready = None
+    try:
+        with httpx.Client(timeout=5) as client:
+            while ready is None and time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError(f"server exited with {server.returncode} in {mode} mode")
+                if first_response is None and request(client, url, path):
+                    first_response = time.perf_counter() - started
+                if first_response is not None and request(client, url, "/ready"):
+                    ready = time.perf_counter() - started
+                time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait()
+    return first_response, ready
+
+
+def median(values):
+    values = [value for value in values if value is not None]
+    return f"{statistics.median(values):6.2f} s" if values else "  timeout"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", default="blocking,background,lazy")
+    parser.add_argument("--path", default="/generate_notebook")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    imports = [import_seconds() for _ in range(args.runs)]
+    print(f"import main: median {median(imports)}  min {min(imports):6.2f} s  max {max(imports):6.2f} s")
+
+    for mode in args.modes.split(","):
+        runs = [server_run(mode, args.port, args.path, args.timeout) for _ in range(args.runs)]
+        print(
+            f"  {mode:<11} first 200 on {args.path}: {median(run[0] for run in runs)}  "
+            f"ready: {median(run[1] for run in runs)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
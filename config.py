@@ -8,11 +8,126 @@ class Config:
     PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     MONGODB_URI = os.getenv("MONGODB_URI")
+    # One pooled client per worker; connections above the minimum are opened on demand
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+    EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+    # Leave empty to keep the embedding cache in memory only
+    EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "")
+    # Embedding backend: "torch", or "onnx" for onnxruntime (needs the onnx extra, falls back to torch)
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+    # int8 dynamic quantization of the ONNX model for this CPU: "avx2", "avx512", "avx512_vnni" or "arm64"; empty for fp32
+    EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "")
+    EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "data/onnx")
+    # Intra-op threads per encode call; 0 lets the runtime use every core
+    EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+
+    # Vector store: "pinecone" (hosted), "faiss" (local, persisted to FAISS_INDEX_DIR) or "faiss_compact"
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+    PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "fyp-context")
+    FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "data/faiss")
+    # Workers sharing FAISS_INDEX_DIR check for an index published by another worker this often
+    FAISS_REFRESH_SECONDS = float(os.getenv("FAISS_REFRESH_SECONDS", "5"))
+    # "faiss_compact": memory-mapped "flat", "sq8" (int8) or "pq" segments with columnar metadata, shared by workers
+    COMPACT_INDEX_DIR = os.getenv("COMPACT_INDEX_DIR", "data/compact")
+    COMPACT_CODEC = os.getenv("COMPACT_CODEC", "sq8")
+    # PQ sub-quantizers of one byte each; must divide EMBEDDING_DIM
+    COMPACT_PQ_M = int(os.getenv("COMPACT_PQ_M", "48"))
+    # How soon a worker sees segments flushed by another worker
+    COMPACT_REFRESH_SECONDS = float(os.getenv("COMPACT_REFRESH_SECONDS", "5"))
+    # A segment is rewritten once this share of its rows is deleted; past COMPACT_MAX_SEGMENTS small ones are merged
+    COMPACT_DELETED_RATIO = float(os.getenv("COMPACT_DELETED_RATIO", "0.2"))
+    COMPACT_MAX_SEGMENTS = int(os.getenv("COMPACT_MAX_SEGMENTS", "8"))
+
+    # Retrieval caching
+    RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+    SELECTION_REFRESH_SECONDS = float(os.getenv("SELECTION_REFRESH_SECONDS", "30"))
+    # Concurrent queries when a hosted store answers a batch of per-cell queries
+    QUERY_MAX_WORKERS = int(os.getenv("QUERY_MAX_WORKERS", "8"))
+
+    # Hybrid retrieval: BM25 over a local inverted index fused with dense results
+    HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+    LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "data/lexical")
+    # Every worker holds the index in memory and reloads it this long after another worker flushed
+    LEXICAL_REFRESH_SECONDS = float(os.getenv("LEXICAL_REFRESH_SECONDS", "5"))
+    # Candidates taken from each retriever before fusion, and the RRF rank constant
+    RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    # Cross-encoder that reorders the fused candidates; leave empty to skip reranking
+    RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+
+    # Token budgets for retrieved context per endpoint, and for the structure pasted into feedback requests
+    TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+    CONTEXT_TOKENS_CELL = int(os.getenv("CONTEXT_TOKENS_CELL", "1200"))
+    CONTEXT_TOKENS_ALL_CELLS = int(os.getenv("CONTEXT_TOKENS_ALL_CELLS", "1200"))
+    CONTEXT_TOKENS_STRUCTURE = int(os.getenv("CONTEXT_TOKENS_STRUCTURE", "2000"))
+    CONTEXT_TOKENS_TOPICS = int(os.getenv("CONTEXT_TOKENS_TOPICS", "2000"))
+    FEEDBACK_STRUCTURE_TOKENS = int(os.getenv("FEEDBACK_STRUCTURE_TOKENS", "3000"))
+    # A truncated passage shorter than this is dropped rather than sent as a fragment
+    CONTEXT_MIN_PASSAGE_TOKENS = int(os.getenv("CONTEXT_MIN_PASSAGE_TOKENS", "48"))
+
+    # Chunks of context per endpoint
+    TOP_K_CELL = int(os.getenv("TOP_K_CELL", "3"))
+    TOP_K_ALL_CELLS = int(os.getenv("TOP_K_ALL_CELLS", "3"))
+    TOP_K_STRUCTURE = int(os.getenv("TOP_K_STRUCTURE", "3"))
+    TOP_K_TOPICS = int(os.getenv("TOP_K_TOPICS", "3"))
+
+    # Generation tuning
+    CELL_CONCURRENCY = int(os.getenv("CELL_CONCURRENCY", "8"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+    LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+    # Directory of cell prompt templates under src/generate_notebooks/prompts
+    PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1")
+
+    # Coalescing of identical in-flight requests; set SINGLE_FLIGHT_PATH to share them across workers on the host
+    SINGLE_FLIGHT_PATH = os.getenv("SINGLE_FLIGHT_PATH", "")
+    SINGLE_FLIGHT_LEASE_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE_SECONDS", "180"))
+    SINGLE_FLIGHT_POLL_SECONDS = float(os.getenv("SINGLE_FLIGHT_POLL_SECONDS", "0.2"))
+    SINGLE_FLIGHT_RESULT_TTL_SECONDS = float(os.getenv("SINGLE_FLIGHT_RESULT_TTL_SECONDS", "10"))
+
+    # Multi-notebook pipeline: notebooks in flight at once (cells share CELL_CONCURRENCY) and where zips are kept
+    PIPELINE_NOTEBOOK_CONCURRENCY = int(os.getenv("PIPELINE_NOTEBOOK_CONCURRENCY", "3"))
+    PIPELINE_RESULTS_DIR = os.getenv("PIPELINE_RESULTS_DIR", "data/pipelines")
+    PIPELINE_RESULT_TTL_SECONDS = float(os.getenv("PIPELINE_RESULT_TTL_SECONDS", "3600"))
+
+    # Completion caching; leave COMPLETION_CACHE_PATH empty to keep it in memory only
+    COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "512"))
+    COMPLETION_CACHE_TTL_SECONDS = float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH", "data/completions.sqlite3")
+
+    # Ingest tuning
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+    UPSERT_MAX_WORKERS = int(os.getenv("UPSERT_MAX_WORKERS", "4"))
+    # Pinecone accepts at most 1000 ids per delete call
+    DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", "1000"))
+    EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+    PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+    # Page ranges extracted ahead of chunking; bounds how many pages are held in memory
+    PDF_WINDOW_TASKS = int(os.getenv("PDF_WINDOW_TASKS", "4"))
+
+    # Startup: "background" serves right away and warms up behind /ready, "blocking" warms up
+    # before serving, "lazy" loads each model and client on first use
+    WARMUP_MODE = os.getenv("WARMUP_MODE", "background")
+
+    # Background ingestion
+    INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "data/ingest_jobs.sqlite3")
+    INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "data/uploads")
+    INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "1"))
+    INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "5"))
+    INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "600"))
+    INGEST_CHECKPOINT_CHUNKS = int(os.getenv("INGEST_CHECKPOINT_CHUNKS", "512"))
 
     @classmethod
     def validate(cls):
+        # The Pinecone key is only needed when Pinecone is the vector backend
+        optional = {"PINECONE_API_KEY"} if cls.VECTOR_BACKEND != "pinecone" else set()
         for key, value in cls.__dict__.items():
-            if not key.startswith("__") and value is None:
+            if not key.startswith("__") and key not in optional and value is None:
                 raise ValueError(f"Environment variable {key} is not set. Please check your .env file.")
-
-Config.validate()
\ No newline at end of file
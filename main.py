@@ -1,11 +1,42 @@
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
+from config import Config
+from common.completion_cache import cell_cache, completion_cache
+from common.registry import registry
+from common.router import router as common_router
+from common.single_flight import single_flight
+from generate_notebooks.pipeline import router as pipeline_router
 from generate_notebooks.router import router as generate_notebook_router
+from src.index_data.jobs import ingest_workers, job_queue
 from src.index_data.router import router as index_data_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Checked here rather than at import so tools can import the app without a full .env
+    Config.validate()
+    # Correctness rather than warm-up (unique content hashes), so it runs in every mode before serving
+    await registry.ensure_indexes()
+    # Load the embedder and open shared clients before serving traffic, behind /ready, or on first use
+    if Config.WARMUP_MODE == "blocking":
+        await registry.warmup()
+    elif Config.WARMUP_MODE == "background":
+        registry.start_warmup()
+    elif Config.WARMUP_MODE != "lazy":
+        raise ValueError(f"Unknown WARMUP_MODE: {Config.WARMUP_MODE}")
+    ingest_workers.start()
+    yield
+    await ingest_workers.stop()
+    await registry.close()
+    job_queue.close()
+    completion_cache.close()
+    cell_cache.close()
+    single_flight.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,7 +47,9 @@ app.add_middleware(
 )
 
 app.include_router(generate_notebook_router)
+app.include_router(pipeline_router)
 app.include_router(index_data_router)
+app.include_router(common_router)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,46 @@
+"""
+Backfill the BM25 lexical index from the vector store for documents that
+were indexed before hybrid retrieval existed.
+
+    python -m scripts.build_lexical_index
+
+Chunk ids come from the chunk registry and their text from the vector
+store's metadata, so nothing is re-embedded. Documents without a registry
+entry must be migrated with scripts/migrate_chunk_ids.py first. Chunks
+already in the lexical index are replaced, so the script can be re-run.
+"""
+import argparse
+import asyncio
+
+from config import Config
+from common.registry import registry
+
+# Pinecone's fetch is a GET with the ids in the query string; keep batches small
+FETCH_BATCH_SIZE = 100
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    Config.validate()
+
+    store = await registry.get_vector_store()
+    lexical_index = await registry.get_lexical_index()
+    try:
+        async for entry in registry.chunk_registry.find({}, {'filename': 1, 'vector_ids': 1}):
+            added = 0
+            # Entries of a new document whose first ingest is still running have no ids yet
+            vector_ids = entry.get('vector_ids', [])
+            for start in range(0, len(vector_ids), FETCH_BATCH_SIZE):
+                chunks = await asyncio.to_thread(store.fetch_metadata, vector_ids[start:start + FETCH_BATCH_SIZE])
+                await asyncio.to_thread(lexical_index.add, chunks)
+                added += len(chunks)
+            await asyncio.to_thread(lexical_index.flush)
+            print(f"{entry['filename']}: {added} chunks")
+        print(f"lexical index at {Config.LEXICAL_INDEX_DIR} holds {len(lexical_index)} chunks")
+    finally:
+        await registry.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
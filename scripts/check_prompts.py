@@ -0,0 +1,47 @@
+"""
+Check the cell prompt templates of PROMPT_VERSION against their manifest.
+
+    python -m scripts.check_prompts [--version v1] [--write]
+
+Exits non-zero when a template was edited in place, added or removed
+without updating manifest.json, or no longer has the token count recorded
+there, or when those counts can't be checked because tiktoken can't load
+the manifest's encoding. --write records the current templates and token
+counts instead, for a new version directory. Token counts use
+TOKEN_ENCODING, so run it where tiktoken can load the encoding; --write
+refuses to record estimates.
+"""
+import argparse
+import json
+import sys
+
+from config import Config
+from generate_notebooks.prompts import PromptRegistry, counter_encoding, prompt_registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--version", default=Config.PROMPT_VERSION)
+    parser.add_argument("--write", action="store_true", help="rewrite manifest.json from the templates")
+    args = parser.parse_args()
+
+    # The configured version is the app's shared registry
+    prompts = prompt_registry if args.version == Config.PROMPT_VERSION else PromptRegistry(args.version)
+    if args.write:
+        if counter_encoding() != Config.TOKEN_ENCODING:
+            sys.exit(f"tiktoken can't load {Config.TOKEN_ENCODING}; not recording estimated token counts")
+        prompts.manifest = prompts.build_manifest()
+        (prompts.directory / "manifest.json").write_text(json.dumps(prompts.manifest, indent=2) + "\n")
+
+    print(f"{prompts.directory}: {len(prompts.templates)} templates, tokens in {prompts.manifest.get('encoding')}")
+    for name in prompts.templates:
+        print(f"  {name:<24} {prompts.tokens(name):5d} tokens  sha256 {prompts.digests[name][:12]}")
+
+    problems = prompts.check()
+    for problem in problems:
+        print(f"  {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Maintain the compact local vector store (VECTOR_BACKEND=faiss_compact).
+
+    python -m scripts.compact_vector_store [--import-faiss data/faiss] [--full]
+
+--import-faiss copies every vector of a FaissVectorStore directory into the
+compact store at COMPACT_INDEX_DIR, replacing chunks with the same id, so
+an existing local index can be switched over without re-embedding. --full
+merges all segments into one and drops deleted rows; flushes only rewrite
+segments past COMPACT_DELETED_RATIO. Safe to run while the API is serving:
+workers pick up the new segments within COMPACT_REFRESH_SECONDS.
+"""
+import argparse
+import itertools
+
+from config import Config
+from common.compact_store import CompactVectorStore
+from common.vector_store import FaissVectorStore
+
+IMPORT_BATCH_SIZE = 10000
+
+
+def import_faiss(store: CompactVectorStore, directory: str) -> int:
+    vectors = FaissVectorStore(directory).export()
+    imported = 0
+    while batch := list(itertools.islice(vectors, IMPORT_BATCH_SIZE)):
+        store.upsert(batch)
+        imported += len(batch)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-faiss", metavar="DIRECTORY", help="FaissVectorStore directory to copy vectors from")
+    parser.add_argument("--full", action="store_true", help="merge every segment into one")
+    args = parser.parse_args()
+
+    store = CompactVectorStore(Config.COMPACT_INDEX_DIR)
+    if args.import_faiss:
+        print(f"imported {import_faiss(store, args.import_faiss)} vectors from {args.import_faiss}")
+    store.flush(full_compaction=args.full)
+
+    stats = store.stats()
+    print(
+        f"{Config.COMPACT_INDEX_DIR}: generation {stats['generation']}, {stats['live_rows']} chunks "
+        f"in {len(stats['segments'])} segments, {stats['bytes_on_disk'] / 2 ** 20:.1f} MiB on disk"
+    )
+    for name, segment in stats["segments"].items():
+        print(f"  {name}: {segment['rows']} rows ({segment['codec']}), {segment['deleted']} deleted")
+
+
+if __name__ == "__main__":
+    main()
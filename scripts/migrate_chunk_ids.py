@@ -0,0 +1,73 @@
+"""
+One-off migration of vectors indexed with random UUID ids to deterministic
+`<doc_key>#<chunk_id>` ids, recording them in the chunk registry so
+/delete_pdf can remove them without a similarity scan.
+
+    python -m scripts.migrate_chunk_ids [--dry-run]
+
+Each batch of legacy vectors is re-upserted under the new ids (with doc_key
+added to their metadata), added to the lexical index and the registry
+before the old ids are deleted, so an interrupted run can simply be
+restarted.
+"""
+import argparse
+import asyncio
+
+from config import Config
+from common.registry import registry
+from src.index_data.chunk_registry import chunk_vector_id, delete_in_batches, document_key, flush_indexes
+
+# Pinecone caps top_k at 10000; stay well below it so each pass is a modest request
+MIGRATION_BATCH_SIZE = 1000
+
+
+async def migrate_document(store, filename: str) -> int:
+    doc_key = document_key(filename)
+    migrated = 0
+    while True:
+        legacy = await asyncio.to_thread(store.fetch_legacy, filename, MIGRATION_BATCH_SIZE)
+        if not legacy:
+            break
+        vectors = [
+            (chunk_vector_id(doc_key, int(metadata["chunk_id"])), values, {**metadata, "doc_key": doc_key})
+            for _, values, metadata in legacy
+        ]
+        await asyncio.to_thread(store.upsert, vectors)
+        await asyncio.to_thread(
+            registry.lexical_index.add, [(vector_id, metadata) for vector_id, _, metadata in vectors]
+        )
+        await registry.chunk_registry.update_one(
+            {'_id': doc_key},
+            {
+                '$set': {'filename': filename},
+                '$addToSet': {'vector_ids': {'$each': [vector_id for vector_id, _, _ in vectors]}}
+            },
+            upsert=True
+        )
+        await asyncio.to_thread(delete_in_batches, store, [vector_id for vector_id, _, _ in legacy])
+        await asyncio.to_thread(flush_indexes, store)
+        migrated += len(legacy)
+    return migrated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only report which documents have legacy vectors")
+    args = parser.parse_args()
+    Config.validate()
+
+    store = await registry.get_vector_store()
+    try:
+        for filename in await registry.document_repository.names():
+            if args.dry_run:
+                legacy = await asyncio.to_thread(store.fetch_legacy, filename, 1)
+                print(f"{filename}: {'needs migration' if legacy else 'up to date'}")
+                continue
+            migrated = await migrate_document(store, filename)
+            print(f"{filename}: migrated {migrated} vectors")
+    finally:
+        await registry.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,707 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import Config
+from common.vector_store import VectorStore
+
+# Metadata key stored in its own blob; every other key becomes a column
+TEXT_FIELD = "text"
+# Rows the store needs before it trains its shared quantizer. Until then flushes are written
+# as "flat" segments, which are merged into the first quantized one once they add up to this
+MIN_TRAINING_ROWS = {"flat": 0, "sq8": 1000, "pq": 10000}
+TRAINING_SAMPLE_ROWS = 50000
+# Vectors of a segment being written, until `finish` has encoded them
+VECTORS_SCRATCH = "vectors.f32"
+# Rows scored per block by the numpy PQ scan, bounds its temporary (queries x rows x M) table lookups
+PQ_BLOCK_ROWS = 8192
+_MISSING = object()
+
+
+def open_blob(path: str):
+    # np.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class BlobWriter:
+    """
+    Appends variable-length byte strings to `<name>.bin`, with their end offsets kept for `<name>.offsets.npy`.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self._file = open(os.path.join(directory, f"{name}.bin"), "wb")
+        self._offsets = array("Q", [0])
+
+    def add(self, data: bytes):
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        self._file.close()
+        np.save(os.path.join(self.directory, f"{self.name}.offsets.npy"), np.frombuffer(self._offsets, dtype=np.uint64))
+
+
+class Blob:
+    """
+    Read side of BlobWriter: entry `row` is a zero-copy slice of the memory-mapped blob.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.data = open_blob(os.path.join(directory, f"{name}.bin"))
+        self.offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+
+    def __getitem__(self, row: int) -> str:
+        return bytes(self.data[int(self.offsets[row]):int(self.offsets[row + 1])]).decode()
+
+    def all(self):
+        data, offsets = bytes(self.data), self.offsets.tolist()
+        return [data[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class SegmentWriter:
+    """
+    Builds one segment directory from (id, vector, metadata) rows.
+
+    Ids and chunk text are streamed to blob files as rows arrive. The other
+    metadata keys are collected per key and written by `finish` as the
+    narrowest column that holds them: integers as an int32/int64 array,
+    repeated strings (filename, doc_key) as uint32 codes into a value list,
+    anything else as JSON in a blob.
+    """
+
+    def __init__(self, directory: str, dimension: int):
+        os.makedirs(directory)
+        self.directory = directory
+        self.dimension = dimension
+        self.rows = 0
+        self._ids = BlobWriter(directory, "ids")
+        self._text = BlobWriter(directory, "text")
+        self._columns = {}
+        self._vectors = open(os.path.join(directory, VECTORS_SCRATCH), "wb")
+
+    def add(self, vector_id: str, vector, metadata: dict):
+        self._ids.add(vector_id.encode())
+        self._text.add(metadata.get(TEXT_FIELD, "").encode())
+        self._vectors.write(np.asarray(vector, dtype=np.float32).tobytes())
+        for key, value in metadata.items():
+            if key != TEXT_FIELD:
+                if key not in self._columns:
+                    self._columns[key] = [_MISSING] * self.rows
+                self._columns[key].append(value)
+        self.rows += 1
+        for values in self._columns.values():
+            if len(values) < self.rows:
+                values.append(_MISSING)
+
+    def _write_column(self, key: str, values) -> dict:
+        present = [value for value in values if value is not _MISSING]
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+            dtype = np.int32
+            if present and (min(present) <= np.iinfo(np.int32).min or max(present) > np.iinfo(np.int32).max):
+                dtype = np.int64
+            missing = int(np.iinfo(dtype).min)
+            column = np.array([missing if value is _MISSING else value for value in values], dtype=dtype)
+            np.save(os.path.join(self.directory, f"{key}.npy"), column)
+            return {"kind": "int", "missing": missing}
+        # Strings repeated across rows (filename, doc_key) are dictionary-coded, unique ones go to a blob
+        if all(isinstance(value, str) for value in present) and len(set(present)) <= max(256, len(present) // 2):
+            categories = {}
+            codes = np.array([
+                np.iinfo(np.uint32).max if value is _MISSING else categories.setdefault(value, len(categories))
+                for value in values
+            ], dtype=np.uint32)
+            np.save(os.path.join(self.directory, f"{key}.npy"), codes)
+            return {"kind": "category", "values": list(categories)}
+        blob = BlobWriter(self.directory, key)
+        for value in values:
+            blob.add(b"" if value is _MISSING else json.dumps(value).encode())
+        blob.close()
+        return {"kind": "json"}
+
+    def _scratch(self):
+        return np.memmap(
+            os.path.join(self.directory, VECTORS_SCRATCH), dtype=np.float32, mode="r", shape=(self.rows, self.dimension)
+        )
+
+    def sample(self):
+        """
+        Up to TRAINING_SAMPLE_ROWS of the vectors added so far, spread evenly, to train a quantizer on.
+        """
+        self._vectors.flush()
+        vectors = self._scratch()
+        return np.array(vectors[np.linspace(0, self.rows - 1, min(self.rows, TRAINING_SAMPLE_ROWS), dtype=np.int64)])
+
+    def _write_codes(self, quantizer) -> str:
+        import faiss
+
+        vectors = self._scratch()
+        if isinstance(quantizer, faiss.ProductQuantizer):
+            codes = np.lib.format.open_memmap(
+                os.path.join(self.directory, "codes.npy"), mode="w+", dtype=np.uint8, shape=(self.rows, quantizer.code_size)
+            )
+            for start in range(0, self.rows, PQ_BLOCK_ROWS):
+                codes[start:start + PQ_BLOCK_ROWS] = quantizer.compute_codes(np.ascontiguousarray(vectors[start:start + PQ_BLOCK_ROWS]))
+            codes.flush()
+            del codes
+            faiss.write_ProductQuantizer(quantizer, os.path.join(self.directory, "pq.faiss"))
+            codec = "pq"
+        else:
+            index = faiss.clone_index(quantizer) if quantizer is not None else faiss.IndexFlatIP(self.dimension)
+            for start in range(0, self.rows, PQ_BLOCK_ROWS):
+                index.add(np.ascontiguousarray(vectors[start:start + PQ_BLOCK_ROWS]))
+            faiss.write_index(index, os.path.join(self.directory, "index.faiss"))
+            codec = "sq8" if quantizer is not None else "flat"
+        del vectors
+        return codec
+
+    def finish(self, quantizer=None) -> str:
+        """
+        Encode the vectors with `quantizer` (a trained sq8 index or ProductQuantizer; None stores them
+        unquantized) and write the columns and schema.
+        """
+        self._ids.close()
+        self._text.close()
+        self._vectors.close()
+        schema = {
+            "rows": self.rows,
+            "codec": self._write_codes(quantizer) if self.rows else "flat",
+            "columns": {key: self._write_column(key, values) for key, values in self._columns.items()},
+        }
+        os.remove(os.path.join(self.directory, VECTORS_SCRATCH))
+        with open(os.path.join(self.directory, "schema.json"), "w") as f:
+            json.dump(schema, f)
+        return self.directory
+
+
+class Segment:
+    """
+    An immutable, memory-mapped slice of a CompactVectorStore.
+
+    Codes, columns and blobs are opened with mmap, so opening a segment
+    reads only its schema, and every worker on the host shares the same
+    pages. "flat" and "sq8" codes are a faiss index opened in place;
+    "pq" codes are a uint8 matrix scored here against the query's inner
+    product tables, since faiss' IndexPQ can't search a subset of rows.
+    Vectors are not kept apart from their codes; `vectors` decodes them.
+    """
+
+    def __init__(self, directory: str, dimension: int):
+        import faiss
+
+        self.name = os.path.basename(directory)
+        self.dimension = dimension
+        with open(os.path.join(directory, "schema.json")) as f:
+            schema = json.load(f)
+        self.rows = schema["rows"]
+        self.codec = schema["codec"]
+        self.schema = schema["columns"]
+        self.ids = Blob(directory, "ids")
+        self.text = Blob(directory, "text")
+        self.columns = {
+            key: Blob(directory, key) if spec["kind"] == "json" else np.load(os.path.join(directory, f"{key}.npy"), mmap_mode="r")
+            for key, spec in self.schema.items()
+        }
+        self.index = self.pq = self.codes = None
+        if self.codec == "pq":
+            self.pq = faiss.read_ProductQuantizer(os.path.join(directory, "pq.faiss"))
+            self.codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r")
+        elif self.rows:
+            self.index = faiss.read_index(
+                os.path.join(directory, "index.faiss"), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+            )
+
+    def vector_id(self, row: int) -> str:
+        return self.ids[row]
+
+    def metadata(self, row: int) -> dict:
+        metadata = {}
+        for key, spec in self.schema.items():
+            column = self.columns[key]
+            if spec["kind"] == "json":
+                value = column[row]
+                if value:
+                    metadata[key] = json.loads(value)
+            elif spec["kind"] == "category":
+                code = int(column[row])
+                if code < len(spec["values"]):
+                    metadata[key] = spec["values"][code]
+            elif int(column[row]) != spec["missing"]:
+                metadata[key] = int(column[row])
+        metadata[TEXT_FIELD] = self.text[row]
+        return metadata
+
+    def vectors(self, rows):
+        """
+        Decode the vectors of `rows` from their codes; approximate for "sq8" and "pq".
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.codec == "pq":
+            return self.pq.decode(np.ascontiguousarray(self.codes[rows]))
+        return self.index.reconstruct_batch(rows)
+
+    def vector(self, row: int):
+        return self.vectors([row])[0]
+
+    def filename_mask(self, filenames):
+        """
+        Rows whose filename is one of `filenames`, without decoding any metadata.
+        """
+        spec = self.schema.get("filename")
+        if spec is None or spec["kind"] != "category":
+            return np.zeros(self.rows, dtype=bool)
+        wanted = [code for code, value in enumerate(spec["values"]) if value in filenames]
+        return np.isin(self.columns["filename"], wanted)
+
+    def search(self, queries, top_k: int, mask=None):
+        """
+        Return (scores, rows) of the top_k rows per query, restricted to `mask` when given; missing hits have row -1.
+        """
+        import faiss
+
+        top_k = min(top_k, self.rows)
+        if self.codec != "pq":
+            params = None
+            if mask is not None:
+                bitmap = np.packbits(mask, bitorder="little")
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(self.rows, faiss.swig_ptr(bitmap)))
+            return self.index.search(queries, top_k, params=params)
+
+        tables = np.empty((len(queries), self.pq.M, self.pq.ksub), dtype=np.float32)
+        self.pq.compute_inner_prod_tables(len(queries), faiss.swig_ptr(queries), faiss.swig_ptr(tables))
+        candidates = np.flatnonzero(mask) if mask is not None else np.arange(self.rows)
+        subspaces = np.arange(self.pq.M)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(candidates), PQ_BLOCK_ROWS):
+            rows = candidates[start:start + PQ_BLOCK_ROWS]
+            scores = tables[:, subspaces, self.codes[rows]].sum(axis=2)
+            best_scores = np.hstack([best_scores, scores])
+            best_rows = np.hstack([best_rows, np.broadcast_to(rows, scores.shape)])
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        scores = np.take_along_axis(best_scores, order, axis=1)
+        rows = np.take_along_axis(best_rows, order, axis=1)
+        if rows.shape[1] < top_k:
+            pad = top_k - rows.shape[1]
+            scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+            rows = np.pad(rows, ((0, 0), (0, pad)), constant_values=-1)
+        return scores, rows
+
+
+class CompactVectorStore(VectorStore):
+    """
+    Local vector store built for large corpora and multi-worker hosts.
+
+    Chunks live in immutable segments (see Segment): quantized codes and
+    columnar metadata in memory-mapped files, so opening the store is
+    instant and every worker shares the same pages. A manifest names the
+    live segments and their deleted rows. Upserts go to an in-memory table
+    that `flush` writes out as a new segment; deletes mark rows as deleted.
+
+    Every segment is encoded with one quantizer per store, trained once
+    from the first MIN_TRAINING_ROWS flushed rows, so segments of any size
+    are quantized and rewriting one re-encodes its decoded vectors to the
+    same codes. Until the store has that many rows its segments are "flat";
+    the compaction that gets there merges them into the first quantized one.
+
+    `flush` takes a file lock, rebases onto the newest manifest (another
+    worker may have flushed meanwhile) and publishes a new one. Segments
+    with more than COMPACT_DELETED_RATIO deleted rows are then rewritten,
+    and once there are more than COMPACT_MAX_SEGMENTS every segment but the
+    largest is merged. Other workers pick up new manifests within
+    COMPACT_REFRESH_SECONDS.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = "manifest.lock"
+
+    def __init__(
+        self, directory: str, dimension: int = Config.EMBEDDING_DIM, codec: str = Config.COMPACT_CODEC,
+        pq_m: int = Config.COMPACT_PQ_M, refresh_seconds: float = Config.COMPACT_REFRESH_SECONDS
+    ):
+        if codec not in MIN_TRAINING_ROWS:
+            raise ValueError(f"Unknown COMPACT_CODEC: {codec}")
+        self.directory = directory
+        self.dimension = dimension
+        self.codec = codec
+        self.pq_m = pq_m
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._generation = None
+        self._segments = {}
+        self._deleted = {}
+        self._locations = None
+        self._pending_deletes = set()
+        self._new = {}
+        self._new_matrix = None
+        self._quantizer = None
+        self._checked = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._refresh(force=True)
+
+    # Manifest and segments
+
+    @contextmanager
+    def _exclusive(self):
+        with open(os.path.join(self.directory, self.LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "segments": [], "tombstones": None}
+
+    def _refresh(self, force=False):
+        if not force and time.monotonic() - self._checked < self.refresh_seconds:
+            return
+        self._checked = time.monotonic()
+        for attempt in range(3):
+            manifest = self._read_manifest()
+            if manifest["generation"] == self._generation:
+                return
+            try:
+                self._open(manifest)
+                return
+            except FileNotFoundError:
+                # A newer manifest replaced this one and its files were removed while opening; read it again
+                if attempt == 2:
+                    raise
+
+    def _open(self, manifest: dict):
+        segments = {
+            name: self._segments.get(name) or Segment(os.path.join(self.directory, name), self.dimension)
+            for name in manifest["segments"]
+        }
+        deleted = {name: np.zeros(segment.rows, dtype=bool) for name, segment in segments.items()}
+        if manifest["tombstones"]:
+            with np.load(os.path.join(self.directory, manifest["tombstones"])) as stored:
+                for name in stored.files:
+                    if name in deleted:
+                        deleted[name] = np.unpackbits(stored[name], count=segments[name].rows, bitorder="little").astype(bool)
+        self._segments, self._deleted, self._generation = segments, deleted, manifest["generation"]
+        self._locations = None
+        # Deletes this worker hasn't flushed yet still apply on top of the newer state
+        for vector_id in self._pending_deletes:
+            self._tombstone(vector_id)
+
+    def _publish(self):
+        """
+        Write the tombstones and a manifest for the current segments, then remove files no manifest refers to.
+        """
+        generation = self._generation + 1
+        tombstones = None
+        if any(deleted.any() for deleted in self._deleted.values()):
+            tombstones = f"tombstones-{generation}.npz"
+            with open(os.path.join(self.directory, tombstones + ".tmp"), "wb") as f:
+                np.savez(f, **{
+                    name: np.packbits(deleted, bitorder="little")
+                    for name, deleted in self._deleted.items() if deleted.any()
+                })
+            os.replace(os.path.join(self.directory, tombstones + ".tmp"), os.path.join(self.directory, tombstones))
+
+        manifest = {"generation": generation, "segments": list(self._segments), "tombstones": tombstones}
+        manifest_path = os.path.join(self.directory, self.MANIFEST_FILE)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        self._generation = generation
+
+        # Workers still reading the old files keep them open; unlinking doesn't disturb their mmaps
+        keep = {self.MANIFEST_FILE, self.LOCK_FILE, tombstones, *self._segments}
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(("seg-", "tombstones-")) and entry.name not in keep:
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.remove(entry.path)
+
+    def _quantizer_path(self) -> str:
+        name = f"quantizer-pq{self.pq_m}.faiss" if self.codec == "pq" else f"quantizer-{self.codec}.faiss"
+        return os.path.join(self.directory, name)
+
+    def _trained_quantizer(self):
+        """
+        The store's shared quantizer, or None while it has too few rows to train one (always for "flat").
+        """
+        if self._quantizer is None and self.codec != "flat" and os.path.exists(self._quantizer_path()):
+            import faiss
+
+            read = faiss.read_ProductQuantizer if self.codec == "pq" else faiss.read_index
+            self._quantizer = read(self._quantizer_path())
+        return self._quantizer
+
+    def _train_quantizer(self, sample):
+        import faiss
+
+        if self.codec == "pq":
+            quantizer, write = faiss.ProductQuantizer(self.dimension, self.pq_m, 8), faiss.write_ProductQuantizer
+        else:
+            quantizer = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            write = faiss.write_index
+        quantizer.train(sample)
+        path = self._quantizer_path()
+        write(quantizer, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._quantizer = quantizer
+        return quantizer
+
+    def _write_segment(self, rows) -> Segment:
+        """
+        Write (id, vector, metadata) rows as a new segment and open it.
+        """
+        writer = SegmentWriter(os.path.join(self.directory, f"seg-{uuid.uuid4().hex[:12]}"), self.dimension)
+        for vector_id, vector, metadata in rows:
+            writer.add(vector_id, vector, metadata)
+        quantizer = self._trained_quantizer()
+        if quantizer is None and self.codec != "flat" and writer.rows >= MIN_TRAINING_ROWS[self.codec]:
+            quantizer = self._train_quantizer(writer.sample())
+        return Segment(writer.finish(quantizer), self.dimension)
+
+    def _live_rows(self, names):
+        for name in names:
+            segment, live = self._segments[name], np.flatnonzero(~self._deleted[name])
+            for start in range(0, len(live), PQ_BLOCK_ROWS):
+                rows = live[start:start + PQ_BLOCK_ROWS]
+                for row, vector in zip(rows.tolist(), segment.vectors(rows)):
+                    yield segment.vector_id(row), vector, segment.metadata(row)
+
+    def _merge(self, names):
+        merged = self._write_segment(self._live_rows(names))
+        for name in names:
+            del self._segments[name]
+            del self._deleted[name]
+        if merged.rows:
+            self._segments[merged.name] = merged
+            self._deleted[merged.name] = np.zeros(merged.rows, dtype=bool)
+        self._locations = None
+
+    def _compact(self, full: bool = False):
+        due = {name for name, deleted in self._deleted.items() if deleted.mean() > Config.COMPACT_DELETED_RATIO}
+        if full:
+            due = set(self._segments)
+        elif len(self._segments) > Config.COMPACT_MAX_SEGMENTS:
+            # Tiered: small segments from recent flushes are merged together, the largest is only rewritten for deletes
+            largest = max(self._segments, key=lambda name: self._segments[name].rows)
+            due |= set(self._segments) - {largest}
+        # Segments in another codec: "flat" ones written before the quantizer was trained, or all of them after
+        # COMPACT_CODEC changed. Re-encoded once there is a quantizer, or enough of their rows to train one
+        mismatched = {name for name, segment in self._segments.items() if segment.codec != self.codec}
+        if self._trained_quantizer() is not None or sum(
+            int((~self._deleted[name]).sum()) for name in mismatched
+        ) >= MIN_TRAINING_ROWS[self.codec]:
+            due |= mismatched
+        names = [name for name in self._segments if name in due]
+        if names and (len(names) > 1 or self._deleted[names[0]].any() or names[0] in mismatched):
+            self._merge(names)
+            return True
+        return False
+
+    # Lookups
+
+    def _locate(self, vector_id: str):
+        if self._locations is None:
+            # Built on first use only: workers that just search never decode the ids
+            self._locations = {
+                vector_id: (name, row)
+                for name, segment in self._segments.items() for row, vector_id in enumerate(segment.ids.all())
+            }
+        location = self._locations.get(vector_id)
+        if location is None or self._deleted[location[0]][location[1]]:
+            return None
+        return location
+
+    def _tombstone(self, vector_id: str) -> bool:
+        location = self._locate(vector_id)
+        if location is None:
+            return False
+        self._deleted[location[0]][location[1]] = True
+        return True
+
+    def _normalize(self, values):
+        matrix = np.asarray(values, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    # VectorStore
+
+    def __len__(self):
+        with self._lock:
+            return len(self._new) + sum(int((~deleted).sum()) for deleted in self._deleted.values())
+
+    def upsert(self, vectors):
+        if not vectors:
+            return
+        matrix = self._normalize([values for _, values, _ in vectors])
+        with self._lock:
+            self._refresh()
+            for (vector_id, _, metadata), vector in zip(vectors, matrix):
+                if vector_id not in self._new and self._tombstone(vector_id):
+                    self._pending_deletes.add(vector_id)
+                self._new[vector_id] = (vector, metadata)
+            self._new_matrix = None
+
+    def update_metadata(self, entries):
+        with self._lock:
+            self._refresh()
+            rows = []
+            for vector_id, metadata in entries:
+                if vector_id in self._new:
+                    rows.append((vector_id, self._new[vector_id][0], metadata))
+                elif (location := self._locate(vector_id)) is not None:
+                    rows.append((vector_id, self._segments[location[0]].vector(location[1]), metadata))
+            self.upsert(rows)
+
+    def query(self, vector, top_k: int, filenames=None):
+        return self.query_many([vector], top_k, filenames=filenames)[0]
+
+    def query_many(self, vectors, top_k: int, filenames=None):
+        if not vectors:
+            return []
+        queries = self._normalize(vectors)
+        with self._lock:
+            self._refresh()
+            wanted = set(filenames) if filenames is not None else None
+            # (score, segment name or None for unflushed rows, row) candidates per query
+            candidates = [[] for _ in vectors]
+            for name, segment in self._segments.items():
+                deleted = self._deleted[name]
+                mask = ~deleted if deleted.any() else None
+                if wanted is not None:
+                    mask = segment.filename_mask(wanted) & (~deleted)
+                if segment.rows == 0 or (mask is not None and not mask.any()):
+                    continue
+                scores, rows = segment.search(queries, top_k, mask)
+                for hits, row_scores, row_numbers in zip(candidates, scores.tolist(), rows.tolist()):
+                    hits.extend((score, name, row) for score, row in zip(row_scores, row_numbers) if row != -1)
+
+            if self._new:
+                new_ids = list(self._new)
+                if self._new_matrix is None:
+                    self._new_matrix = np.vstack([vector for vector, _ in self._new.values()])
+                scores = queries @ self._new_matrix.T
+                allowed = [
+                    position for position, vector_id in enumerate(new_ids)
+                    if wanted is None or self._new[vector_id][1].get("filename") in wanted
+                ]
+                for hits, row_scores in zip(candidates, scores.tolist()):
+                    hits.extend((row_scores[position], None, new_ids[position]) for position in allowed)
+
+            results = []
+            for hits in candidates:
+                hits.sort(key=lambda hit: -hit[0])
+                matches = []
+                for score, name, row in hits[:top_k]:
+                    if name is None:
+                        matches.append({"id": row, "score": float(score), "metadata": self._new[row][1]})
+                    else:
+                        segment = self._segments[name]
+                        matches.append({"id": segment.vector_id(row), "score": float(score), "metadata": segment.metadata(row)})
+                results.append(matches)
+            return results
+
+    def delete(self, ids):
+        with self._lock:
+            self._refresh()
+            for vector_id in ids:
+                if self._new.pop(vector_id, None) is not None:
+                    self._new_matrix = None
+                if self._tombstone(vector_id):
+                    self._pending_deletes.add(vector_id)
+
+    def delete_by_filename(self, filename: str) -> int:
+        with self._lock:
+            self._refresh()
+            vector_ids = [
+                self._segments[name].vector_id(row)
+                for name, segment in self._segments.items()
+                for row in np.flatnonzero(segment.filename_mask({filename}) & ~self._deleted[name]).tolist()
+            ]
+            vector_ids += [vector_id for vector_id, (_, metadata) in self._new.items() if metadata.get("filename") == filename]
+            self.delete(vector_ids)
+            return len(vector_ids)
+
+    def fetch_metadata(self, ids):
+        with self._lock:
+            self._refresh()
+            found = []
+            for vector_id in ids:
+                if vector_id in self._new:
+                    found.append((vector_id, self._new[vector_id][1]))
+                elif (location := self._locate(vector_id)) is not None:
+                    found.append((vector_id, self._segments[location[0]].metadata(location[1])))
+            return found
+
+    def fetch_legacy(self, filename: str, limit: int):
+        with self._lock:
+            self._refresh()
+            legacy = [
+                (vector_id, vector.tolist(), metadata) for vector_id, (vector, metadata) in self._new.items()
+                if metadata.get("filename") == filename and "doc_key" not in metadata
+            ]
+            for name, segment in self._segments.items():
+                for row in np.flatnonzero(segment.filename_mask({filename}) & ~self._deleted[name]).tolist():
+                    if len(legacy) >= limit:
+                        return legacy
+                    metadata = segment.metadata(row)
+                    if "doc_key" not in metadata:
+                        legacy.append((segment.vector_id(row), segment.vector(row).tolist(), metadata))
+            return legacy[:limit]
+
+    def flush(self, full_compaction: bool = False):
+        """
+        Publish unflushed upserts and deletes, compacting segments when due.
+        """
+        with self._lock, self._exclusive():
+            manifest = self._read_manifest()
+            if manifest["generation"] != self._generation:
+                self._open(manifest)
+            changed = bool(self._new or self._pending_deletes)
+            if self._new:
+                segment = self._write_segment(
+                    (vector_id, vector, metadata) for vector_id, (vector, metadata) in self._new.items()
+                )
+                self._segments[segment.name] = segment
+                self._deleted[segment.name] = np.zeros(segment.rows, dtype=bool)
+                if self._locations is not None:
+                    self._locations.update((segment.vector_id(row), (segment.name, row)) for row in range(segment.rows))
+            self._new = {}
+            self._new_matrix = None
+            self._pending_deletes = set()
+            if self._compact(full=full_compaction) or changed:
+                self._publish()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = sum(
+                entry.stat().st_size
+                for name in self._segments for entry in os.scandir(os.path.join(self.directory, name))
+            )
+            return {
+                "generation": self._generation,
+                "segments": {name: {"rows": segment.rows, "codec": segment.codec, "deleted": int(self._deleted[name].sum())}
+                             for name, segment in self._segments.items()},
+                "live_rows": len(self),
+                "unflushed": len(self._new),
+                "bytes_on_disk": size,
+            }
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+
+class CompletionCache:
+    """
+    Content-addressed cache of chat completion texts.
+
+    Keys are a hash of the full request (model, messages, response format),
+    so identical prompts replay the stored completion. Entries live in an
+    in-process LRU and, when `path` is set, in a SQLite table shared by all
+    workers on the host. Entries older than `ttl_seconds` are treated as misses.
+    Caches that share a SQLite file keep their entries in separate tables.
+    The file is opened on first use, so importing the app touches no files.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, path: str = None, table: str = "completions"):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.table = table
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.path = path
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    def _connection(self):
+        # Called with self._lock held
+        if self._db is None and self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, tokens INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def key(request: dict) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def _fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl_seconds
+
+    def get(self, key: str):
+        """
+        Return the cached completion text, or None on a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._fresh(entry[2]):
+                del self._memory[key]
+                entry = None
+            db = self._connection() if entry is None else None
+            if db is not None:
+                row = db.execute(
+                    f"SELECT content, tokens, created_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and self._fresh(row[2]):
+                    entry = row
+                    self._remember(key, entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self._memory.move_to_end(key)
+            self.hits += 1
+            self.tokens_saved += entry[1]
+            return entry[0]
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, content: str, tokens: int):
+        entry = (content, tokens, time.time())
+        with self._lock:
+            self._remember(key, entry)
+            db = self._connection()
+            if db is not None:
+                db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, content, tokens, created_at) VALUES (?, ?, ?, ?)",
+                    (key, *entry)
+                )
+                db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+completion_cache = CompletionCache(
+    Config.COMPLETION_CACHE_SIZE,
+    Config.COMPLETION_CACHE_TTL_SECONDS,
+    path=Config.COMPLETION_CACHE_PATH or None
+)
+# Generated cell content by cell fingerprint, for incremental regeneration; kept apart so
+# restoring a cell doesn't count as a cached completion
+cell_cache = CompletionCache(
+    Config.COMPLETION_CACHE_SIZE,
+    Config.COMPLETION_CACHE_TTL_SECONDS,
+    path=Config.COMPLETION_CACHE_PATH or None,
+    table="cells"
+)
@@ -0,0 +1,80 @@
+class DocumentRepository:
+    """
+    Every query the app runs against the `fyp.documents` collection.
+
+    A document is {name, content_hash, selected}. Reads project only the
+    fields they use, and every lookup is served by an index from
+    `ensure_indexes`; only `names` reads the whole collection.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        """
+        Create the indexes behind the lookups below (no-ops once they exist).
+        """
+        # Partial so documents indexed before content hashing don't collide on a missing hash
+        await self.collection.create_index(
+            'content_hash', unique=True, partialFilterExpression={'content_hash': {'$exists': True}}
+        )
+        # Unique so concurrent uploads of one filename can't record two documents;
+        # replaces the plain index that earlier versions created under the same name
+        indexes = await self.collection.index_information()
+        if 'name_1' in indexes and not indexes['name_1'].get('unique'):
+            await self.collection.drop_index('name_1')
+        await self.collection.create_index('name', unique=True)
+        # Only the selected few are indexed, which is all selected_names() asks for
+        await self.collection.create_index('selected', partialFilterExpression={'selected': True})
+
+    async def names(self):
+        return [doc['name'] async for doc in self.collection.find({}, {'name': 1, '_id': 0})]
+
+    async def selected_names(self) -> frozenset:
+        return frozenset([doc['name'] async for doc in self.collection.find({'selected': True}, {'name': 1, '_id': 0})])
+
+    async def content_hashes(self, names):
+        """
+        Return (name, content_hash) pairs for `names`; documents indexed before content hashing have "".
+        """
+        return [
+            (doc['name'], doc.get('content_hash', ''))
+            async for doc in self.collection.find({'name': {'$in': list(names)}}, {'name': 1, 'content_hash': 1, '_id': 0})
+        ]
+
+    async def find_by_hash(self, content_hash: str):
+        """
+        Name of the document with this content, or None.
+        """
+        doc = await self.collection.find_one({'content_hash': content_hash}, {'name': 1, '_id': 0})
+        return doc['name'] if doc else None
+
+    async def exists(self, name: str) -> bool:
+        return await self.collection.find_one({'name': name}, {'_id': 1}) is not None
+
+    async def record_indexed(self, name: str, content_hash: str):
+        """
+        Store the content hash of a freshly indexed document; new documents start unselected.
+        """
+        await self.collection.update_one(
+            {'name': name},
+            {'$set': {'content_hash': content_hash}, '$setOnInsert': {'selected': False}},
+            upsert=True
+        )
+
+    async def delete(self, name: str) -> int:
+        result = await self.collection.delete_one({'name': name})
+        return result.deleted_count
+
+    async def set_selection(self, names):
+        """
+        Select exactly `names`, in one round trip.
+        """
+        from pymongo import UpdateMany
+
+        names = list(names)
+        # Filters only match documents whose flag actually changes, so unchanged ones aren't rewritten
+        await self.collection.bulk_write([
+            UpdateMany({'name': {'$nin': names}, 'selected': True}, {'$set': {'selected': False}}),
+            UpdateMany({'name': {'$in': names}, 'selected': {'$ne': True}}, {'$set': {'selected': True}}),
+        ], ordered=False)
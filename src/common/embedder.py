@@ -0,0 +1,104 @@
+import logging
+import os
+import re
+from pathlib import Path
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Quantized exports are named after the CPU instruction set they target
+QUANTIZATIONS = ("avx2", "avx512", "avx512_vnni", "arm64")
+
+
+def embedding_variant(backend: str = None, quantization: str = None) -> str:
+    """
+    Name of the embedding model and its numeric format, used to key the
+    embedding cache. fp32 ONNX reproduces the PyTorch vectors, int8 does not.
+    """
+    backend = backend or Config.EMBEDDING_BACKEND
+    quantization = Config.EMBEDDING_QUANTIZATION if quantization is None else quantization
+    if backend == "onnx" and quantization:
+        return f"{Config.EMBEDDING_MODEL}:qint8_{quantization}"
+    return Config.EMBEDDING_MODEL
+
+
+def find_onnx_file(directory: str, quantization: str = ""):
+    """
+    Path of the exported (or quantized) ONNX file relative to `directory`, or None if it doesn't exist yet.
+    """
+    name = f"model_qint8_{quantization}.onnx" if quantization else "model.onnx"
+    for path in sorted(Path(directory).glob(f"**/{name}")):
+        return path.relative_to(directory).as_posix()
+    return None
+
+
+def export_onnx_model(model_name: str, quantization: str, directory: str) -> str:
+    """
+    Export `model_name` to ONNX under `directory` (and quantize it) unless
+    a previous run already did, returning the model's directory.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    target = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+    if find_onnx_file(target) is None:
+        logger.info("Exporting %s to ONNX in %s", model_name, target)
+        # Uses the ONNX file published with the model when there is one, otherwise converts the weights
+        SentenceTransformer(model_name, backend="onnx").save_pretrained(target)
+    if quantization and find_onnx_file(target, quantization) is None:
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown EMBEDDING_QUANTIZATION: {quantization}")
+        logger.info("Quantizing %s to int8 for %s", model_name, quantization)
+        model = SentenceTransformer(target, backend="onnx", model_kwargs={"file_name": find_onnx_file(target)})
+        export_dynamic_quantized_onnx_model(model, quantization, target)
+    return target
+
+
+def load_onnx_embedder(quantization: str, threads: int):
+    import onnxruntime
+    from sentence_transformers import SentenceTransformer
+
+    target = export_onnx_model(Config.EMBEDDING_MODEL, quantization, Config.EMBEDDING_ONNX_DIR)
+    options = onnxruntime.SessionOptions()
+    if threads:
+        options.intra_op_num_threads = threads
+    # One encode call runs at a time per embed worker; parallelism comes from intra-op threads
+    options.inter_op_num_threads = 1
+    return SentenceTransformer(target, backend="onnx", model_kwargs={
+        "file_name": find_onnx_file(target, quantization),
+        "provider": "CPUExecutionProvider",
+        "session_options": options,
+    })
+
+
+def load_embedder(backend: str = None, quantization: str = None, threads: int = None):
+    """
+    Load the sentence-transformers embedder on the configured backend.
+
+    "onnx" runs the model through onnxruntime, optionally int8-quantized for
+    EMBEDDING_QUANTIZATION, and falls back to PyTorch if onnxruntime or the
+    export is unavailable. Both expose the same encode() and tokenizer.
+    The returned model's `embedding_variant` names the backend that actually
+    loaded, so a fallback never shares cached vectors with the int8 model.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or Config.EMBEDDING_BACKEND
+    quantization = Config.EMBEDDING_QUANTIZATION if quantization is None else quantization
+    threads = Config.EMBEDDING_THREADS if threads is None else threads
+    if backend == "onnx":
+        try:
+            model = load_onnx_embedder(quantization, threads)
+            model.embedding_variant = embedding_variant("onnx", quantization)
+            return model
+        except Exception as error:
+            logger.warning("Falling back to the PyTorch embedder, the ONNX backend failed to load: %r", error)
+    elif backend != "torch":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    model = SentenceTransformer(Config.EMBEDDING_MODEL)
+    model.embedding_variant = embedding_variant("torch")
+    return model
@@ -0,0 +1,213 @@
+import fcntl
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class DiskEmbeddingStore:
+    """
+    Append-only on-disk embedding store, shared by every process using its directory.
+
+    Vectors live in a memory-mapped float32 matrix (`vectors.f32`) and an
+    append-only text file (`index.txt`) maps each content hash to its row.
+    Writers hold a file lock while they catch up on rows other processes
+    appended, claim the next free rows and grow the matrix by doubling. The
+    matrix file only ever grows, so mappings other processes hold stay
+    valid. A miss re-reads the index tail, so rows stored by other processes
+    become hits.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    INDEX_FILE = "index.txt"
+    LOCK_FILE = "index.lock"
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, directory: str, dimension: int):
+        self.dimension = dimension
+        self.vectors_path = os.path.join(directory, self.VECTORS_FILE)
+        self.index_path = os.path.join(directory, self.INDEX_FILE)
+        self.lock_path = os.path.join(directory, self.LOCK_FILE)
+        os.makedirs(directory, exist_ok=True)
+
+        self._rows = {}
+        self._next_row = 0
+        self._index_offset = 0
+        self._vectors = None
+        self._index_file = open(self.index_path, "a")
+        with self._exclusive():
+            self._catch_up()
+            self._grow(max(self.INITIAL_CAPACITY, self._next_row))
+        self._map()
+
+    @contextmanager
+    def _exclusive(self):
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _catch_up(self):
+        """
+        Read the index lines appended since the last call, by any process.
+        """
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        # A line another process is still writing is picked up by a later call
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode().splitlines():
+            key, _, row = line.partition(" ")
+            if row:
+                self._rows[key] = int(row)
+                self._next_row = max(self._next_row, int(row) + 1)
+        self._index_offset += end
+
+    def _grow(self, rows: int):
+        """
+        Make the matrix file hold at least `rows` rows. Only called with the lock held.
+        """
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if size >= rows * self.dimension * 4:
+            return
+        capacity = max(self.INITIAL_CAPACITY, size // (4 * self.dimension))
+        while capacity < rows:
+            capacity *= 2
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dimension * 4)
+
+    def _map(self):
+        capacity = os.path.getsize(self.vectors_path) // (4 * self.dimension)
+        if self._vectors is None or capacity > self._vectors.shape[0]:
+            if self._vectors is not None:
+                self._vectors.flush()
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, key: str):
+        row = self._rows.get(key)
+        if row is None:
+            if os.path.getsize(self.index_path) == self._index_offset:
+                return None
+            self._catch_up()
+            row = self._rows.get(key)
+            if row is None:
+                return None
+        if row >= self._vectors.shape[0]:
+            self._map()
+        return np.array(self._vectors[row])
+
+    def put_many(self, items):
+        """
+        Store (key, vector) pairs, skipping keys any process has stored already.
+        """
+        with self._exclusive():
+            self._catch_up()
+            fresh = {key: vector for key, vector in items if key not in self._rows}
+            if not fresh:
+                return
+            start = self._next_row
+            self._grow(start + len(fresh))
+            self._map()
+            for row, vector in enumerate(fresh.values(), start):
+                self._vectors[row] = vector
+            # Rows are written before their index lines, so a crash can only lose entries, never corrupt one
+            self._vectors.flush()
+            self._index_file.write("".join(f"{key} {row}\n" for row, key in enumerate(fresh, start)))
+            self._index_file.flush()
+            self._rows.update((key, row) for row, key in enumerate(fresh, start))
+            self._next_row = start + len(fresh)
+
+    def put(self, key: str, vector):
+        self.put_many([(key, vector)])
+
+    def flush(self):
+        self._vectors.flush()
+        self._index_file.flush()
+
+    def close(self):
+        self.flush()
+        self._index_file.close()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by a hash of (model name, text).
+
+    The first tier is an in-process LRU; the optional second tier is a
+    DiskEmbeddingStore that survives restarts and is promoted into the LRU
+    on hit.
+    """
+
+    def __init__(self, model_name: str, dimension: int, max_entries: int, directory: str = None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = DiskEmbeddingStore(directory, dimension) if directory else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode()).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts):
+        """
+        Return one cached vector (or None on a miss) per text.
+        """
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                elif self._disk is not None and (vector := self._disk.get(key)) is not None:
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, texts, vectors):
+        with self._lock:
+            stored = []
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                stored.append((key, vector))
+            if self._disk is not None:
+                self._disk.put_many(stored)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk) if self._disk is not None else 0,
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
@@ -0,0 +1,395 @@
+import fcntl
+import json
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import Config
+
+# Identifiers keep their dots and underscores (np.linalg.norm, train_test_split)
+# so exact API names can be matched; their parts are indexed as well.
+TOKEN = re.compile(r"[a-z0-9_]+(?:\.[a-z0-9_]+)*")
+IDENTIFIER_SEPARATOR = re.compile(r"[._]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str):
+    """
+    Lowercased terms of `text`; compound identifiers yield the whole identifier and its parts.
+    """
+    terms = []
+    for token in TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if "." in token or "_" in token:
+            terms.extend(part for part in IDENTIFIER_SEPARATOR.split(token) if part and part not in STOPWORDS)
+    return terms
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk text, persisted under `directory`.
+
+    Each chunk gets a dense document number. The postings of a term are two
+    parallel uint32 arrays (document numbers and term frequencies) that new
+    chunks are appended to, so indexing is incremental. Deleted chunks are
+    tombstoned and dropped from the postings when a snapshot is written.
+    Results have the same shape as VectorStore.query.
+
+    Workers may share the directory. manifest.json names the current
+    snapshot (postings and documents) and a journal of the adds and deletes
+    published since it, and is swapped atomically. Each worker remembers its
+    own changes since its last flush; `flush` does nothing without any, and
+    otherwise takes a file lock, catches up with what other workers
+    published, reapplies those changes and appends them to the journal. The
+    snapshot is only rewritten once the journal outgrows JOURNAL_RATIO of the
+    index, so a flush costs about what changed. Workers pick up newer
+    generations within LEXICAL_REFRESH_SECONDS.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = "manifest.lock"
+    # Single-snapshot layout written before manifests; read when there is no manifest yet
+    POSTINGS_FILE = "postings.npz"
+    DOCUMENTS_FILE = "documents.json"
+    JOURNAL_RATIO = 0.5
+
+    def __init__(
+        self, directory: str, k1: float = 1.2, b: float = 0.75, refresh_seconds: float = Config.LEXICAL_REFRESH_SECONDS
+    ):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._generation = None
+        self._snapshot = None
+        self._journal_offset = 0
+        self._checked = 0.0
+        # Changes since the last flush: id -> metadata, or None for a delete
+        self._pending = {}
+        self._reset()
+        self._refresh(force=True)
+
+    def _reset(self):
+        self._ids = []
+        self._metadata = []
+        self._lengths = array("I")
+        self._alive = bytearray()
+        self._numbers = {}
+        self._by_filename = {}
+        self._postings = {}
+        self._live = 0
+        self._total_length = 0
+
+    @contextmanager
+    def _exclusive(self):
+        with open(os.path.join(self.directory, self.LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {
+                "generation": 0, "postings": self.POSTINGS_FILE, "documents": self.DOCUMENTS_FILE,
+                "journal": None, "journal_size": 0, "journal_entries": 0,
+            }
+
+    def _write_manifest(self, manifest: dict):
+        manifest_path = os.path.join(self.directory, self.MANIFEST_FILE)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _refresh(self, force=False):
+        if not force and time.monotonic() - self._checked < self.refresh_seconds:
+            return
+        self._checked = time.monotonic()
+        for attempt in range(3):
+            try:
+                self._catch_up(self._read_manifest())
+                return
+            except FileNotFoundError:
+                # A new snapshot was published and this one removed while reading it; read the manifest again
+                if attempt == 2:
+                    raise
+
+    def _catch_up(self, manifest: dict):
+        if manifest["generation"] == self._generation:
+            return
+        if manifest["postings"] != self._snapshot:
+            self._load(manifest)
+            return
+        touched = self._replay(manifest)
+        # Changes this worker hasn't flushed yet still apply on top of the newer state
+        self._apply([(vector_id, self._pending[vector_id]) for vector_id in touched if vector_id in self._pending])
+
+    def _load(self, manifest: dict):
+        postings_path = os.path.join(self.directory, manifest["postings"])
+        documents_path = os.path.join(self.directory, manifest["documents"])
+        stored = None
+        if manifest["generation"] or (os.path.exists(postings_path) and os.path.exists(documents_path)):
+            with open(documents_path) as f:
+                stored = json.load(f)
+            with np.load(postings_path) as arrays:
+                lengths, offsets = arrays["lengths"], arrays["offsets"]
+                documents, frequencies = arrays["documents"], arrays["frequencies"]
+
+        self._reset()
+        if stored is not None:
+            for vector_id, metadata, length in zip(stored["ids"], stored["metadata"], lengths.tolist()):
+                self._append_document(vector_id, metadata, length)
+            for term, start, end in zip(stored["terms"], offsets[:-1].tolist(), offsets[1:].tolist()):
+                self._postings[term] = (array("I", documents[start:end].tobytes()), array("I", frequencies[start:end].tobytes()))
+        self._snapshot = manifest["postings"]
+        self._journal_offset = 0
+        self._replay(manifest)
+        self._apply(list(self._pending.items()))
+
+    def _replay(self, manifest: dict) -> set:
+        """
+        Apply the journal entries published since this worker last read it; return the ids they touched.
+        """
+        changes = []
+        if manifest["journal_size"] > self._journal_offset:
+            with open(os.path.join(self.directory, manifest["journal"]), "rb") as f:
+                f.seek(self._journal_offset)
+                # Bytes past journal_size belong to a flush that never published its manifest
+                changes = [json.loads(line) for line in f.read(manifest["journal_size"] - self._journal_offset).splitlines()]
+        self._apply([(change["id"], change["metadata"]) for change in changes])
+        self._journal_offset = manifest["journal_size"]
+        self._generation = manifest["generation"]
+        return {change["id"] for change in changes}
+
+    def _append_document(self, vector_id, metadata, length):
+        number = len(self._ids)
+        self._ids.append(vector_id)
+        self._metadata.append(metadata)
+        self._lengths.append(length)
+        self._alive.append(1)
+        self._numbers[vector_id] = number
+        self._by_filename.setdefault(metadata.get("filename"), set()).add(number)
+        self._live += 1
+        self._total_length += length
+        return number
+
+    def _remove(self, number):
+        self._alive[number] = 0
+        keys = self._by_filename.get(self._metadata[number].get("filename"))
+        if keys is not None:
+            keys.discard(number)
+            if not keys:
+                del self._by_filename[self._metadata[number].get("filename")]
+        del self._numbers[self._ids[number]]
+        self._live -= 1
+        self._total_length -= self._lengths[number]
+
+    def __len__(self):
+        return self._live
+
+    def _add(self, entries):
+        for vector_id, metadata in entries:
+            if vector_id in self._numbers:
+                self._remove(self._numbers[vector_id])
+            terms = tokenize(metadata.get("text", ""))
+            number = self._append_document(vector_id, metadata, len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = (array("I"), array("I"))
+                postings[0].append(number)
+                postings[1].append(count)
+
+    def _delete(self, ids):
+        for vector_id in ids:
+            number = self._numbers.get(vector_id)
+            if number is not None:
+                self._remove(number)
+
+    def _apply(self, changes):
+        for vector_id, metadata in changes:
+            if metadata is None:
+                self._delete([vector_id])
+            else:
+                self._add([(vector_id, metadata)])
+
+    def add(self, entries):
+        """
+        Index (id, metadata) pairs by their metadata["text"], replacing chunks with the same id.
+        """
+        entries = list(entries)
+        with self._lock:
+            self._refresh()
+            self._add(entries)
+            self._pending.update(entries)
+
+    def delete(self, ids):
+        with self._lock:
+            self._refresh()
+            ids = [vector_id for vector_id in ids if vector_id in self._numbers]
+            self._delete(ids)
+            self._pending.update((vector_id, None) for vector_id in ids)
+
+    def delete_by_filename(self, filename: str) -> int:
+        with self._lock:
+            self._refresh()
+            ids = [self._ids[number] for number in self._by_filename.get(filename, ())]
+            self.delete(ids)
+            return len(ids)
+
+    def query(self, text: str, top_k: int, filenames=None):
+        return self.query_many([text], top_k, filenames=filenames)[0]
+
+    def query_many(self, texts, top_k: int, filenames=None):
+        """
+        Return the top_k chunks by BM25 score for each query text, restricted to `filenames` when given.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._live:
+                return [[] for _ in texts]
+            alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+            if filenames is not None:
+                allowed = np.zeros(len(self._ids), dtype=bool)
+                for filename in filenames:
+                    allowed[list(self._by_filename.get(filename, ()))] = True
+                alive &= allowed
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            # Length normalisation is shared by every term of every query in the batch
+            norms = self.k1 * (1 - self.b + self.b * lengths / (self._total_length / self._live))
+            results = []
+            for text in texts:
+                scores = np.zeros(len(self._ids), dtype=np.float32)
+                for term in set(tokenize(text)):
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        continue
+                    documents = np.frombuffer(postings[0], dtype=np.uint32)
+                    frequencies = np.frombuffer(postings[1], dtype=np.uint32).astype(np.float32)
+                    # Postings still hold tombstoned chunks until the next snapshot, so df is approximate in between
+                    idf = math.log(1 + (self._live - len(documents) + 0.5) / (len(documents) + 0.5))
+                    scores[documents] += idf * frequencies * (self.k1 + 1) / (frequencies + norms[documents])
+                    del documents
+                scores[~alive] = 0
+                candidates = np.flatnonzero(scores)
+                if len(candidates) > top_k:
+                    candidates = candidates[np.argpartition(-scores[candidates], top_k)[:top_k]]
+                candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+                results.append([
+                    {"id": self._ids[number], "score": float(scores[number]), "metadata": self._metadata[number]}
+                    for number in candidates.tolist()
+                ])
+            return results
+
+    def _compact(self):
+        """
+        Renumber the live chunks and drop tombstoned ones from every posting list.
+        """
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        remap = np.cumsum(alive, dtype=np.int64) - 1
+        postings = {}
+        for term, (documents, frequencies) in self._postings.items():
+            documents = np.frombuffer(documents, dtype=np.uint32)
+            keep = alive[documents]
+            if keep.any():
+                postings[term] = (
+                    array("I", remap[documents[keep]].astype(np.uint32).tobytes()),
+                    array("I", np.frombuffer(frequencies, dtype=np.uint32)[keep].tobytes())
+                )
+            del documents
+        survivors = [
+            (self._ids[number], self._metadata[number], self._lengths[number])
+            for number in np.flatnonzero(alive).tolist()
+        ]
+        self._reset()
+        for vector_id, metadata, length in survivors:
+            self._append_document(vector_id, metadata, length)
+        self._postings = postings
+
+    def flush(self):
+        """
+        Publish this worker's changes since its last flush; a no-op without any.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with self._exclusive():
+                manifest = self._read_manifest()
+                self._catch_up(manifest)
+                journal_entries = manifest["journal_entries"] + len(self._pending)
+                if manifest["journal"] is not None and journal_entries <= self.JOURNAL_RATIO * self._live:
+                    self._append_journal(manifest, journal_entries)
+                else:
+                    self._write_snapshot(manifest["generation"] + 1)
+                self._pending = {}
+
+    def _append_journal(self, manifest: dict, journal_entries: int):
+        lines = b"".join(
+            json.dumps({"id": vector_id, "metadata": metadata}).encode() + b"\n"
+            for vector_id, metadata in self._pending.items()
+        )
+        with open(os.path.join(self.directory, manifest["journal"]), "ab") as f:
+            # Drop whatever an interrupted flush appended without publishing it
+            f.truncate(manifest["journal_size"])
+            f.write(lines)
+        manifest = dict(
+            manifest, generation=manifest["generation"] + 1,
+            journal_size=manifest["journal_size"] + len(lines), journal_entries=journal_entries
+        )
+        self._write_manifest(manifest)
+        self._generation = manifest["generation"]
+        self._journal_offset = manifest["journal_size"]
+
+    def _write_snapshot(self, generation: int):
+        if self._live < len(self._ids):
+            self._compact()
+        terms = list(self._postings)
+        sizes = [len(self._postings[term][0]) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        documents = np.empty(offsets[-1], dtype=np.uint32)
+        frequencies = np.empty(offsets[-1], dtype=np.uint32)
+        for term, start, end in zip(terms, offsets[:-1].tolist(), offsets[1:].tolist()):
+            documents[start:end] = np.frombuffer(self._postings[term][0], dtype=np.uint32)
+            frequencies[start:end] = np.frombuffer(self._postings[term][1], dtype=np.uint32)
+
+        # Fresh names per generation: nothing refers to them until the manifest is swapped in
+        names = (f"postings-{generation}.npz", f"documents-{generation}.json", f"journal-{generation}.jsonl")
+        with open(os.path.join(self.directory, names[0]), "wb") as f:
+            np.savez(
+                f, lengths=np.frombuffer(self._lengths, dtype=np.uint32),
+                offsets=offsets, documents=documents, frequencies=frequencies
+            )
+        with open(os.path.join(self.directory, names[1]), "w") as f:
+            json.dump({"ids": self._ids, "metadata": self._metadata, "terms": terms}, f)
+        self._write_manifest({
+            "generation": generation, "postings": names[0], "documents": names[1],
+            "journal": names[2], "journal_size": 0, "journal_entries": 0,
+        })
+        self._generation = generation
+        self._snapshot = names[0]
+        self._journal_offset = 0
+
+        # Older snapshots and journals, the pre-manifest files and leftovers of interrupted flushes
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(("postings", "documents", "journal")) and entry.name not in names:
+                os.remove(entry.path)
@@ -0,0 +1,354 @@
+import asyncio
+import functools
+import multiprocessing
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from config import Config
+import numpy as np
+
+from common.compact_store import CompactVectorStore
+from common.documents import DocumentRepository
+from common.embedder import load_embedder
+from common.embedding_cache import EmbeddingCache
+from common.lexical_index import LexicalIndex
+from common.vector_store import FaissVectorStore, PineconeVectorStore, VectorStore
+
+# torch, sentence-transformers, pinecone, openai and pymongo take most of a
+# worker's import time, so they are imported by the property that first needs them
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from pinecone import Pinecone
+    from pymongo import AsyncMongoClient
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+
+class Registry:
+    """
+    Process-wide holder for the embedding model and external clients.
+
+    Each resource is created on first access and then shared by every
+    router, so a worker loads the model weights and opens its connection
+    pools exactly once. `warmup` creates them all up front; until it has
+    finished `ready` is False.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._embedder = None
+        self._embed_executor = None
+        self._embedding_cache = None
+        self._pdf_executor = None
+        self._pinecone = None
+        self._vector_store = None
+        self._lexical_index = None
+        self._reranker = None
+        self._mongo = None
+        self._document_repository = None
+        self._async_openai = None
+        self.ready = False
+        self.warmup_seconds = None
+        self.warmup_error = None
+        self._warmup_task = None
+
+    @property
+    def embedder(self) -> "SentenceTransformer":
+        if self._embedder is None:
+            with self._lock:
+                if self._embedder is None:
+                    self._embedder = load_embedder()
+        return self._embedder
+
+    @property
+    def embed_executor(self) -> ThreadPoolExecutor:
+        if self._embed_executor is None:
+            with self._lock:
+                if self._embed_executor is None:
+                    self._embed_executor = ThreadPoolExecutor(
+                        max_workers=Config.EMBED_WORKERS,
+                        thread_name_prefix="embed"
+                    )
+        return self._embed_executor
+
+    async def encode(self, texts, **kwargs):
+        """
+        Run the embedder on the dedicated embedding pool so encoding never blocks the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.embed_executor,
+            functools.partial(self.embedder.encode, texts, **kwargs)
+        )
+
+    @property
+    def pdf_executor(self) -> ProcessPoolExecutor:
+        if self._pdf_executor is None:
+            with self._lock:
+                if self._pdf_executor is None:
+                    # spawn, not fork: forking a process that holds torch threads can deadlock
+                    self._pdf_executor = ProcessPoolExecutor(
+                        max_workers=Config.PDF_WORKERS,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._pdf_executor
+
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        if self._embedding_cache is None:
+            # Keyed by the variant that actually loaded, which differs from the config after an ONNX fallback
+            variant = self.embedder.embedding_variant
+            with self._lock:
+                if self._embedding_cache is None:
+                    self._embedding_cache = EmbeddingCache(
+                        variant,
+                        Config.EMBEDDING_DIM,
+                        max_entries=Config.EMBEDDING_CACHE_SIZE,
+                        directory=Config.EMBEDDING_CACHE_DIR or None
+                    )
+        return self._embedding_cache
+
+    async def embed(self, texts, batch_size=None) -> np.ndarray:
+        """
+        Embed a list of texts, encoding only the ones missing from the embedding cache.
+        """
+        cache = self.embedding_cache
+        vectors = cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            kwargs = {"batch_size": batch_size} if batch_size else {}
+            encoded = await self.encode(missing, **kwargs)
+            cache.put_many(missing, encoded)
+            by_text = dict(zip(missing, encoded))
+            vectors = [by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), Config.EMBEDDING_DIM)
+
+    @property
+    def pinecone(self) -> "Pinecone":
+        if self._pinecone is None:
+            with self._lock:
+                if self._pinecone is None:
+                    from pinecone import Pinecone
+                    self._pinecone = Pinecone(api_key=Config.PINECONE_API_KEY)
+        return self._pinecone
+
+    def _pinecone_index(self):
+        from pinecone import ServerlessSpec
+        pc = self.pinecone
+        # Create the index on first use so a fresh project works out of the box
+        if Config.PINECONE_INDEX_NAME not in [index['name'] for index in pc.list_indexes()]:
+            pc.create_index(
+                name=Config.PINECONE_INDEX_NAME,
+                dimension=Config.EMBEDDING_DIM,
+                metric='cosine',
+                spec=ServerlessSpec(
+                    cloud='aws',
+                    region='us-east-1'
+                )
+            )
+        return pc.Index(Config.PINECONE_INDEX_NAME)
+
+    @property
+    def vector_store(self) -> VectorStore:
+        if self._vector_store is None:
+            with self._lock:
+                if self._vector_store is None:
+                    if Config.VECTOR_BACKEND == "faiss":
+                        self._vector_store = FaissVectorStore(Config.FAISS_INDEX_DIR)
+                    elif Config.VECTOR_BACKEND == "faiss_compact":
+                        self._vector_store = CompactVectorStore(Config.COMPACT_INDEX_DIR)
+                    elif Config.VECTOR_BACKEND == "pinecone":
+                        self._vector_store = PineconeVectorStore(self._pinecone_index())
+                    else:
+                        raise ValueError(f"Unknown VECTOR_BACKEND: {Config.VECTOR_BACKEND}")
+        return self._vector_store
+
+    async def get_vector_store(self) -> VectorStore:
+        """
+        Resolve the vector store off the event loop; the first call may hit the network or disk.
+        """
+        if self._vector_store is None:
+            await asyncio.to_thread(lambda: self.vector_store)
+        return self._vector_store
+
+    @property
+    def lexical_index(self) -> LexicalIndex:
+        if self._lexical_index is None:
+            with self._lock:
+                if self._lexical_index is None:
+                    self._lexical_index = LexicalIndex(Config.LEXICAL_INDEX_DIR)
+        return self._lexical_index
+
+    async def get_lexical_index(self) -> LexicalIndex:
+        """
+        Load the lexical index off the event loop; the first call reads it from disk.
+        """
+        if self._lexical_index is None:
+            await asyncio.to_thread(lambda: self.lexical_index)
+        return self._lexical_index
+
+    @property
+    def reranker(self) -> "CrossEncoder":
+        if self._reranker is None:
+            with self._lock:
+                if self._reranker is None:
+                    from sentence_transformers import CrossEncoder
+                    self._reranker = CrossEncoder(Config.RERANK_MODEL)
+        return self._reranker
+
+    async def rerank(self, query: str, texts):
+        """
+        Score (query, text) pairs with the cross-encoder on the embedding pool.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.embed_executor,
+            functools.partial(self.reranker.predict, [(query, text) for text in texts])
+        )
+
+    @property
+    def mongo(self) -> "AsyncMongoClient":
+        if self._mongo is None:
+            with self._lock:
+                if self._mongo is None:
+                    from pymongo import AsyncMongoClient
+                    from pymongo.server_api import ServerApi
+                    self._mongo = AsyncMongoClient(
+                        Config.MONGODB_URI,
+                        server_api=ServerApi('1'),
+                        maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                        minPoolSize=Config.MONGO_MIN_POOL_SIZE
+                    )
+        return self._mongo
+
+    @property
+    def documents(self):
+        return self.mongo['fyp']['documents']
+
+    @property
+    def document_repository(self) -> DocumentRepository:
+        if self._document_repository is None:
+            with self._lock:
+                if self._document_repository is None:
+                    self._document_repository = DocumentRepository(self.documents)
+        return self._document_repository
+
+    @property
+    def chunk_registry(self):
+        return self.mongo['fyp']['chunk_registry']
+
+    @property
+    def async_openai(self) -> "AsyncOpenAI":
+        if self._async_openai is None:
+            with self._lock:
+                if self._async_openai is None:
+                    from openai import AsyncOpenAI
+                    # create_completion owns retries; the client's own would multiply them
+                    self._async_openai = AsyncOpenAI(api_key=Config.OPENAI_API_KEY, max_retries=0)
+        return self._async_openai
+
+    async def warmup(self):
+        """
+        Load the model and open every client so the first request doesn't pay for it.
+        """
+        await self.encode("warmup")
+        await self.get_vector_store()
+        if Config.HYBRID_RETRIEVAL:
+            await self.get_lexical_index()
+        if Config.RERANK_MODEL:
+            await asyncio.to_thread(lambda: self.reranker)
+        await self.mongo.admin.command('ping')
+        self.async_openai
+        self.ready = True
+
+    def start_warmup(self):
+        """
+        Warm up in a background task so the worker serves requests right away.
+        Endpoints that need a resource before then load it on first use.
+        """
+        async def run():
+            started = time.perf_counter()
+            try:
+                await self.warmup()
+            except Exception as error:
+                # Resources that failed here are retried lazily by the requests that need them
+                logger.exception("Background warm-up failed")
+                self.warmup_error = repr(error)
+            else:
+                self.warmup_seconds = time.perf_counter() - started
+                logger.info("Warm-up finished in %.2fs", self.warmup_seconds)
+
+        self._warmup_task = asyncio.create_task(run())
+
+    def status(self) -> dict:
+        """
+        Which shared resources are loaded, for the readiness endpoint.
+        """
+        return {
+            "ready": self.ready,
+            "warmup_seconds": self.warmup_seconds,
+            "warmup_error": self.warmup_error,
+            "embedder": self._embedder is not None,
+            "vector_store": self._vector_store is not None,
+            "lexical_index": self._lexical_index is not None,
+            "reranker": self._reranker is not None,
+            "mongo": self._mongo is not None,
+            "openai": self._async_openai is not None,
+        }
+
+    def embedding_cache_stats(self):
+        """
+        Embedding cache stats, or None until the embedder has loaded, so reporting them never loads the model.
+        """
+        embedding_cache = self._embedding_cache
+        if embedding_cache is None and self._embedder is not None:
+            embedding_cache = self.embedding_cache
+        return embedding_cache.stats() if embedding_cache is not None else None
+
+    async def ensure_indexes(self):
+        await self.document_repository.ensure_indexes()
+
+    async def close(self):
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            self._warmup_task = None
+        with self._lock:
+            self.ready = False
+            mongo, async_openai, embed_executor = self._mongo, self._async_openai, self._embed_executor
+            vector_store, embedding_cache = self._vector_store, self._embedding_cache
+            lexical_index, self._lexical_index = self._lexical_index, None
+            self._reranker = None
+            self._embedding_cache = None
+            pdf_executor, self._pdf_executor = self._pdf_executor, None
+            self._embedder = None
+            self._embed_executor = None
+            self._pinecone = None
+            self._vector_store = None
+            self._mongo = None
+            self._document_repository = None
+            self._async_openai = None
+        self.ready = False
+        self.warmup_seconds = None
+        self.warmup_error = None
+        self._warmup_task = None
+        if vector_store is not None:
+            await asyncio.to_thread(vector_store.flush)
+        if lexical_index is not None:
+            await asyncio.to_thread(lexical_index.flush)
+        if embedding_cache is not None:
+            embedding_cache.close()
+        if mongo is not None:
+            await mongo.close()
+        if async_openai is not None:
+            await async_openai.close()
+        if embed_executor is not None:
+            embed_executor.shutdown(wait=False)
+        if pdf_executor is not None:
+            pdf_executor.shutdown(wait=False, cancel_futures=True)
+
+
+registry = Registry()
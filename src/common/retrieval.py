@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import Config
+from common.registry import registry
+
+
+class CorpusState:
+    """
+    In-memory view of the selected documents plus a version counter.
+
+    The selection is re-read from Mongo every SELECTION_REFRESH_SECONDS to
+    pick up changes made through other workers. `fingerprint()`, a digest of
+    the selected documents' content hashes, is what retrieval cache keys
+    and cell fingerprints use: it is the same in every worker, so a change
+    made through any of them shows up everywhere within that interval. The
+    version is local to this process and is bumped whenever this worker
+    changes the corpus (selection, indexing, deletion), which makes its own
+    changes visible to the fingerprint right away.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.version = 0
+        self._selected = None
+        self._loaded_at = 0.0
+        self._fingerprint = None
+        self._lock = asyncio.Lock()
+
+    async def selected(self) -> frozenset:
+        if self._selected is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            async with self._lock:
+                if self._selected is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                    selected = await registry.document_repository.selected_names()
+                    if selected != self._selected:
+                        self._selected = selected
+                        self.bump()
+                    self._loaded_at = time.monotonic()
+        return self._selected
+
+    async def fingerprint(self) -> str:
+        """
+        Digest of the selected documents' names and content hashes. It is
+        the same in every worker and across restarts, and changes whenever a
+        selected document is re-indexed with new content.
+        """
+        selected = await self.selected()
+        cached = self._fingerprint
+        if cached is not None and cached[0] == self.version and time.monotonic() - cached[1] <= self.refresh_seconds:
+            return cached[2]
+        version = self.version
+        entries = sorted(await registry.document_repository.content_hashes(selected))
+        digest = hashlib.sha256(json.dumps(entries).encode()).hexdigest()
+        self._fingerprint = (version, time.monotonic(), digest)
+        return digest
+
+    def set_selected(self, filenames):
+        self._selected = frozenset(filenames)
+        self._loaded_at = time.monotonic()
+        self.bump()
+
+    def invalidate(self):
+        """
+        Force the selection to be re-read on next use.
+        """
+        self._selected = None
+        self.bump()
+
+    def bump(self):
+        self.version += 1
+
+
+class RetrievalCache:
+    """
+    LRU of vector-store matches keyed by (query embedding, top_k, corpus fingerprint).
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query_vector, top_k: int, corpus_fingerprint: str) -> str:
+        digest = hashlib.sha256(np.asarray(query_vector, dtype=np.float32).tobytes()).hexdigest()
+        return f"{digest}:{top_k}:{corpus_fingerprint}"
+
+    def get(self, key: str):
+        with self._lock:
+            matches = self._entries.get(key)
+            if matches is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return matches
+
+    def put(self, key: str, matches):
+        with self._lock:
+            self._entries[key] = matches
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def reciprocal_rank_fusion(rankings, k: int = Config.RRF_K):
+    """
+    Merge ranked match lists by summing 1 / (k + rank) for every list a chunk
+    appears in; only ranks matter, so dense and BM25 scores need no calibration.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            entry = fused.setdefault(match["id"], {"id": match["id"], "score": 0.0, "metadata": match["metadata"]})
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda match: match["score"], reverse=True)
+
+
+corpus = CorpusState(Config.SELECTION_REFRESH_SECONDS)
+retrieval_cache = RetrievalCache(Config.RETRIEVAL_CACHE_SIZE)
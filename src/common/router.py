@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from config import Config
+from common.completion_cache import cell_cache, completion_cache
+from common.registry import registry
+from common.retrieval import retrieval_cache
+from common.single_flight import single_flight
+from common.token_budget import token_usage
+
+router = APIRouter()
+
+@router.get("/cache_stats")
+async def cache_stats():
+    return {
+        "embeddings": registry.embedding_cache_stats(),
+        "retrieval": retrieval_cache.stats(),
+        "completions": completion_cache.stats(),
+        "cells": cell_cache.stats(),
+        "token_usage": token_usage.stats(),
+        "single_flight": single_flight.stats(),
+    }
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness probe: 503 until warm-up has loaded the models and clients.
+    With WARMUP_MODE=lazy there is nothing to wait for, so it is always ready.
+    """
+    status = registry.status()
+    if Config.WARMUP_MODE == "lazy":
+        status["ready"] = True
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import Config
+
+
+def request_key(endpoint: str, request: dict) -> str:
+    """
+    Hash of an endpoint and its request body, with string whitespace
+    collapsed so trivially different duplicates share a key.
+    """
+    def normalize(value):
+        if isinstance(value, str):
+            return re.sub(r"\s+", " ", value).strip()
+        if isinstance(value, dict):
+            return {key: normalize(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [normalize(item) for item in value]
+        return value
+
+    payload = json.dumps({"endpoint": endpoint, "request": normalize(request)}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SharedFlights:
+    """
+    SQLite table of in-flight computations shared by the workers of one host.
+
+    The first worker to see a key takes a lease on it and later stores the
+    JSON result; the others poll until the result appears or the lease
+    expires (its holder died), in which case one of them takes over.
+    Results are kept for `result_ttl` seconds so requests that arrive just
+    after the leader finished still share its result.
+    """
+
+    def __init__(self, path: str, lease_seconds: float, result_ttl: float):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self):
+        # Called with self._lock held; the file is opened on first use, not at import
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS flights ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "result TEXT, finished_at REAL)"
+            )
+        return self._db
+
+    def acquire(self, key: str, owner: str):
+        """
+        Return ("done", result) if a fresh result exists, ("wait", None) while
+        another worker holds the lease, or ("lead", None) after taking it.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            # BEGIN IMMEDIATE takes the write lock up front so two workers can't both take the lease
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "DELETE FROM flights WHERE (finished_at IS NOT NULL AND finished_at < ?) "
+                    "OR (finished_at IS NULL AND expires_at < ?)",
+                    (now - self.result_ttl, now)
+                )
+                row = db.execute("SELECT owner, result FROM flights WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    db.execute(
+                        "INSERT INTO flights (key, owner, expires_at) VALUES (?, ?, ?)",
+                        (key, owner, now + self.lease_seconds)
+                    )
+                    state = ("lead", None)
+                elif row[1] is not None:
+                    state = ("done", row[1])
+                else:
+                    state = ("wait", None)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return state
+
+    def complete(self, key: str, owner: str, result: str):
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "UPDATE flights SET result = ?, finished_at = ? WHERE key = ? AND owner = ?",
+                (result, time.time(), key, owner)
+            )
+
+    def abandon(self, key: str, owner: str):
+        """
+        Release a lease whose computation failed so a waiting worker can retry it.
+        """
+        with self._lock:
+            db = self._connection()
+            db.execute("DELETE FROM flights WHERE key = ? AND owner = ? AND result IS NULL", (key, owner))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent computations.
+
+    Callers with the same key while one computation is in flight in this
+    process await that computation instead of starting their own. With a
+    SharedFlights store the same holds across workers, for JSON-serializable
+    results. The computation runs as its own task, so a caller that goes
+    away does not cancel it for the others.
+    """
+
+    def __init__(self, shared: SharedFlights = None, poll_seconds: float = 0.2):
+        self.shared = shared
+        self.poll_seconds = poll_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._inflight = {}
+        self.requests = 0
+        self.leaders = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    async def run(self, key: str, compute):
+        """
+        Return the result of `compute()` (a coroutine function), sharing it with identical in-flight calls.
+        """
+        self.requests += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.create_task(self._lead(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _lead(self, key: str, compute):
+        if self.shared is None:
+            self.leaders += 1
+            return await compute()
+
+        while True:
+            state, result = await asyncio.to_thread(self.shared.acquire, key, self.owner)
+            if state == "done":
+                self.shared_hits += 1
+                return json.loads(result)
+            if state == "lead":
+                break
+            await asyncio.sleep(self.poll_seconds)
+
+        self.leaders += 1
+        try:
+            result = await compute()
+        except BaseException:
+            await asyncio.to_thread(self.shared.abandon, key, self.owner)
+            raise
+        await asyncio.to_thread(self.shared.complete, key, self.owner, json.dumps(result))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "in_flight": len(self._inflight),
+        }
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+
+
+single_flight = SingleFlight(
+    SharedFlights(
+        Config.SINGLE_FLIGHT_PATH, Config.SINGLE_FLIGHT_LEASE_SECONDS, Config.SINGLE_FLIGHT_RESULT_TTL_SECONDS
+    ) if Config.SINGLE_FLIGHT_PATH else None,
+    poll_seconds=Config.SINGLE_FLIGHT_POLL_SECONDS
+)
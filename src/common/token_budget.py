@@ -0,0 +1,102 @@
+import logging
+import threading
+from contextvars import ContextVar
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Tags token usage log lines, e.g. with the notebook being generated; inherited by tasks a request spawns
+usage_label = ContextVar("usage_label", default="")
+
+# Used when tiktoken (or its encoding file) is unavailable; close to the English average for OpenAI BPEs
+CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in the tokens of the completion model.
+
+    Uses tiktoken's TOKEN_ENCODING when it can be loaded, and otherwise
+    falls back to a characters-per-token estimate so budgets still apply.
+    """
+
+    def __init__(self, encoding_name: str):
+        self.encoding_name = encoding_name
+        self._lock = threading.Lock()
+        self._encoding = None
+        self._loaded = False
+
+    @property
+    def encoding(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    try:
+                        import tiktoken
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as error:
+                        logger.warning("Estimating token counts, tiktoken is unavailable: %r", error)
+                    self._loaded = True
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        if self.encoding is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Cut `text` to at most `max_tokens`, preferring to end on a sentence or word boundary.
+        """
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            if len(text) <= max_tokens * CHARS_PER_TOKEN:
+                return text
+            cut = text[:max_tokens * CHARS_PER_TOKEN]
+        else:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            cut = self.encoding.decode(tokens[:max_tokens])
+        for boundary in (". ", "\n", " "):
+            end = cut.rfind(boundary)
+            if end > len(cut) // 2:
+                return cut[:end + 1].rstrip()
+        return cut
+
+
+class TokenUsage:
+    """
+    Running totals of the tokens reported by OpenAI responses.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, model: str, usage):
+        if usage is None:
+            return
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.completion_tokens += usage.completion_tokens
+        logger.info(
+            "Token usage [%s] model=%s prompt=%d completion=%d total=%d",
+            usage_label.get() or "-", model, usage.prompt_tokens, usage.completion_tokens, usage.total_tokens
+        )
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+
+token_counter = TokenCounter(Config.TOKEN_ENCODING)
+token_usage = TokenUsage()
@@ -0,0 +1,397 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import Config
+
+
+class VectorStore(ABC):
+    """
+    Minimal interface over a vector index holding PDF chunks.
+
+    Vectors are passed around as (id, values, metadata) tuples, and query
+    results as dicts with "id", "score" and "metadata" keys. Methods are
+    synchronous; async callers run them with asyncio.to_thread.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors):
+        ...
+
+    @abstractmethod
+    def update_metadata(self, entries):
+        """
+        Replace the metadata of stored chunks from (id, metadata) pairs, keeping their vectors.
+        """
+        ...
+
+    @abstractmethod
+    def query(self, vector, top_k: int, filenames=None):
+        """
+        Return the top_k closest chunks, restricted to `filenames` when given.
+        """
+        ...
+
+    def query_many(self, vectors, top_k: int, filenames=None):
+        """
+        Return one result list per query vector. The queries run concurrently;
+        local indexes override this with a single batched search.
+        """
+        if not vectors:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(vectors), Config.QUERY_MAX_WORKERS)) as executor:
+            return list(executor.map(lambda vector: self.query(vector, top_k, filenames=filenames), vectors))
+
+    @abstractmethod
+    def delete(self, ids):
+        ...
+
+    @abstractmethod
+    def delete_by_filename(self, filename: str) -> int:
+        ...
+
+    @abstractmethod
+    def fetch_metadata(self, ids):
+        """
+        Return (id, metadata) pairs for the ids that exist in the store.
+        """
+        ...
+
+    @abstractmethod
+    def fetch_legacy(self, filename: str, limit: int):
+        """
+        Return up to `limit` (id, values, metadata) tuples of `filename` that
+        predate deterministic ids, i.e. whose metadata has no doc_key.
+        """
+        ...
+
+    def flush(self):
+        """
+        Persist pending writes. Hosted backends write through and need nothing here.
+        """
+
+
+class PineconeVectorStore(VectorStore):
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors):
+        self.index.upsert(vectors=vectors)
+
+    def update_metadata(self, entries):
+        # Pinecone updates one vector per call
+        with ThreadPoolExecutor(max_workers=Config.UPSERT_MAX_WORKERS) as executor:
+            list(executor.map(lambda entry: self.index.update(id=entry[0], set_metadata=entry[1]), entries))
+
+    def query(self, vector, top_k: int, filenames=None):
+        response = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            filter={"filename": {"$in": list(filenames)}} if filenames is not None else None
+        )
+        return [
+            {"id": match['id'], "score": match['score'], "metadata": match['metadata']}
+            for match in response['matches']
+        ]
+
+    def delete(self, ids):
+        if ids:
+            self.index.delete(ids=list(ids))
+
+    def delete_by_filename(self, filename: str) -> int:
+        query_response = self.index.query(
+            vector=[0] * Config.EMBEDDING_DIM,  # dummy vector for querying
+            filter={"filename": filename},
+            top_k=10000,
+            include_metadata=True
+        )
+        vector_ids = [match.id for match in query_response.matches]
+        self.delete(vector_ids)
+        return len(vector_ids)
+
+    def fetch_metadata(self, ids):
+        response = self.index.fetch(ids=list(ids))
+        return [(vector_id, vector.metadata) for vector_id, vector in response.vectors.items()]
+
+    def fetch_legacy(self, filename: str, limit: int):
+        response = self.index.query(
+            vector=[0] * Config.EMBEDDING_DIM,  # dummy vector, only the filter matters
+            filter={"filename": filename, "doc_key": {"$exists": False}},
+            top_k=limit,
+            include_values=True,
+            include_metadata=True
+        )
+        return [(match['id'], match['values'], match['metadata']) for match in response['matches']]
+
+
+class FaissVectorStore(VectorStore):
+    """
+    Local cosine-similarity index persisted under `directory`.
+
+    FAISS only knows int64 keys, so a metadata side-table maps each key to
+    the chunk's string id, filename, chunk_id and text. Filtered search
+    restricts the FAISS scan to the keys of the selected files.
+
+    Workers may share the directory. Each one remembers its writes since its
+    last flush; `flush` takes a file lock, reloads the index if another
+    worker published a newer generation, reapplies those writes on top and
+    publishes the result as the next generation named by manifest.json.
+    Workers reload newer generations within FAISS_REFRESH_SECONDS.
+    """
+
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = "manifest.lock"
+    # Single-generation layout written before manifests; read when there is no manifest yet
+    INDEX_FILE = "index.faiss"
+    METADATA_FILE = "metadata.json"
+
+    def __init__(
+        self, directory: str, dimension: int = Config.EMBEDDING_DIM, refresh_seconds: float = Config.FAISS_REFRESH_SECONDS
+    ):
+        self.directory = directory
+        self.dimension = dimension
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.RLock()
+        self._generation = None
+        self._checked = 0.0
+        # Writes since the last flush: id -> (normalized vector, metadata), or None for a delete
+        self._pending = {}
+        self._refresh(force=True)
+
+    @contextmanager
+    def _exclusive(self):
+        with open(os.path.join(self.directory, self.LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "index": self.INDEX_FILE, "metadata": self.METADATA_FILE}
+
+    def _refresh(self, force=False):
+        if not force and time.monotonic() - self._checked < self.refresh_seconds:
+            return
+        self._checked = time.monotonic()
+        for attempt in range(3):
+            manifest = self._read_manifest()
+            if manifest["generation"] == self._generation:
+                return
+            try:
+                self._load(manifest)
+                return
+            except FileNotFoundError:
+                # A newer generation was published and this one removed while loading; read the manifest again
+                if attempt == 2:
+                    raise
+
+    def _load(self, manifest: dict):
+        # Imported here so workers on the Pinecone backend never load faiss
+        import faiss
+        index_path = os.path.join(self.directory, manifest["index"])
+        metadata_path = os.path.join(self.directory, manifest["metadata"])
+        if manifest["generation"] == 0 and not (os.path.exists(index_path) and os.path.exists(metadata_path)):
+            index, stored = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension)), {"next_key": 0, "vectors": []}
+        else:
+            index = faiss.read_index(index_path)
+            with open(metadata_path) as f:
+                stored = json.load(f)
+
+        self.index = index
+        self._keys = {}
+        self._metadata = {}
+        self._by_filename = {}
+        self._next_key = stored["next_key"]
+        for entry in stored["vectors"]:
+            self._track(entry["key"], entry["id"], entry["metadata"])
+        self._generation = manifest["generation"]
+        # Writes this worker hasn't flushed yet still apply on top of the newer state
+        deletes = [vector_id for vector_id, pending in self._pending.items() if pending is None]
+        self._remove(deletes)
+        self._add([(vector_id, *pending) for vector_id, pending in self._pending.items() if pending is not None])
+
+    def _track(self, key, vector_id, metadata):
+        self._keys[vector_id] = key
+        self._metadata[key] = {"id": vector_id, "metadata": metadata}
+        self._by_filename.setdefault(metadata.get("filename"), set()).add(key)
+
+    def _untrack(self, key):
+        entry = self._metadata.pop(key)
+        del self._keys[entry["id"]]
+        keys = self._by_filename.get(entry["metadata"].get("filename"))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_filename[entry["metadata"].get("filename")]
+
+    def _normalize(self, values):
+        import faiss
+        matrix = np.asarray(values, dtype=np.float32).reshape(-1, self.dimension)
+        # Inner product over unit vectors is cosine similarity, matching the Pinecone index
+        faiss.normalize_L2(matrix)
+        return matrix
+
+    def _add(self, rows):
+        """
+        Add (id, normalized vector, metadata) rows, replacing the stored ones with the same id.
+        """
+        if not rows:
+            return
+        self._remove([vector_id for vector_id, _, _ in rows])
+        keys = np.arange(self._next_key, self._next_key + len(rows), dtype=np.int64)
+        self._next_key += len(rows)
+        self.index.add_with_ids(np.vstack([vector for _, vector, _ in rows]), keys)
+        for key, (vector_id, _, metadata) in zip(keys.tolist(), rows):
+            self._track(key, vector_id, metadata)
+
+    def _remove(self, ids):
+        keys = [self._keys[vector_id] for vector_id in ids if vector_id in self._keys]
+        if keys:
+            self.index.remove_ids(np.asarray(keys, dtype=np.int64))
+            for key in keys:
+                self._untrack(key)
+
+    def upsert(self, vectors):
+        if not vectors:
+            return
+        matrix = self._normalize([values for _, values, _ in vectors])
+        rows = [(vector_id, vector, metadata) for (vector_id, _, metadata), vector in zip(vectors, matrix)]
+        with self._lock:
+            self._refresh()
+            self._add(rows)
+            self._pending.update((vector_id, (vector, metadata)) for vector_id, vector, metadata in rows)
+
+    def update_metadata(self, entries):
+        with self._lock:
+            self._refresh()
+            rows = [
+                (vector_id, self.index.reconstruct(self._keys[vector_id]), metadata)
+                for vector_id, metadata in entries if vector_id in self._keys
+            ]
+            self._add(rows)
+            self._pending.update((vector_id, (vector, metadata)) for vector_id, vector, metadata in rows)
+
+    def query(self, vector, top_k: int, filenames=None):
+        return self.query_many([vector], top_k, filenames=filenames)[0]
+
+    def query_many(self, vectors, top_k: int, filenames=None):
+        import faiss
+        with self._lock:
+            self._refresh()
+            params = None
+            if filenames is not None:
+                allowed = [key for filename in filenames for key in self._by_filename.get(filename, ())]
+                if not allowed:
+                    return [[] for _ in vectors]
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(allowed, dtype=np.int64)))
+            if self.index.ntotal == 0 or not vectors:
+                return [[] for _ in vectors]
+
+            # One search call for the whole batch; faiss spreads the queries over its own threads
+            scores, keys = self.index.search(self._normalize(vectors), top_k, params=params)
+            return [
+                [
+                    {"id": self._metadata[key]["id"], "score": float(score), "metadata": self._metadata[key]["metadata"]}
+                    for score, key in zip(row_scores, row_keys)
+                    if key != -1
+                ]
+                for row_scores, row_keys in zip(scores.tolist(), keys.tolist())
+            ]
+
+    def delete(self, ids):
+        with self._lock:
+            self._refresh()
+            self._remove(ids)
+            self._pending.update((vector_id, None) for vector_id in ids)
+
+    def delete_by_filename(self, filename: str) -> int:
+        with self._lock:
+            self._refresh()
+            vector_ids = [self._metadata[key]["id"] for key in self._by_filename.get(filename, ())]
+            self.delete(vector_ids)
+            return len(vector_ids)
+
+    def fetch_metadata(self, ids):
+        with self._lock:
+            self._refresh()
+            return [
+                (vector_id, self._metadata[self._keys[vector_id]]["metadata"])
+                for vector_id in ids if vector_id in self._keys
+            ]
+
+    def fetch_legacy(self, filename: str, limit: int):
+        with self._lock:
+            self._refresh()
+            keys = [
+                key for key in self._by_filename.get(filename, ())
+                if "doc_key" not in self._metadata[key]["metadata"]
+            ][:limit]
+            return [
+                (self._metadata[key]["id"], self.index.reconstruct(key).tolist(), self._metadata[key]["metadata"])
+                for key in keys
+            ]
+
+    def export(self):
+        """
+        Yield every stored (id, values, metadata) tuple, e.g. to copy the index into another store.
+        """
+        with self._lock:
+            self._refresh()
+            index = self.index
+            entries = list(self._metadata.items())
+        for key, entry in entries:
+            yield entry["id"], index.reconstruct(key).tolist(), entry["metadata"]
+
+    def flush(self):
+        """
+        Publish this worker's writes since its last flush as a new generation; a no-op without any.
+        """
+        import faiss
+        with self._lock:
+            if not self._pending:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with self._exclusive():
+                manifest = self._read_manifest()
+                if manifest["generation"] != self._generation:
+                    self._load(manifest)
+                generation = self._generation + 1
+                # Fresh names per generation: nothing refers to them until the manifest is swapped in
+                index_file, metadata_file = f"index-{generation}.faiss", f"metadata-{generation}.json"
+                faiss.write_index(self.index, os.path.join(self.directory, index_file))
+                with open(os.path.join(self.directory, metadata_file), "w") as f:
+                    json.dump({
+                        "next_key": self._next_key,
+                        "vectors": [
+                            {"key": key, "id": entry["id"], "metadata": entry["metadata"]}
+                            for key, entry in self._metadata.items()
+                        ]
+                    }, f)
+                manifest_path = os.path.join(self.directory, self.MANIFEST_FILE)
+                with open(manifest_path + ".tmp", "w") as f:
+                    json.dump({"generation": generation, "index": index_file, "metadata": metadata_file}, f)
+                os.replace(manifest_path + ".tmp", manifest_path)
+                self._generation = generation
+                self._pending = {}
+
+                # Older generations, the pre-manifest files and leftovers of interrupted flushes
+                for entry in os.scandir(self.directory):
+                    if (
+                        entry.name.startswith(("index", "metadata"))
+                        and entry.name not in (index_file, metadata_file)
+                    ):
+                        os.remove(entry.path)
@@ -32,6 +32,10 @@ class Cell(BaseModel):
     content: str
     loading: Optional[bool] = None
     generated: Optional[bool] = None
+    error: Optional[str] = None
+    # Prompt the content was generated from, and the fingerprint incremental regeneration compares
+    prompt: Optional[str] = None
+    fingerprint: Optional[str] = None
 
     @field_validator('type')
     def validate_cell_type(cls, value):
@@ -66,6 +70,17 @@ class TopicResponse(BaseModel):
 
 class NotebookRequest(BaseModel):
     structure: NotebookStructure
+    bypass_cache: bool = False
+    # "cell" retrieves context for each cell's own prompt, "notebook" shares one context for the notebook name
+    context_mode: Literal["cell", "notebook"] = "cell"
+    # Only regenerate cells that are not generated yet or whose fingerprint changed
+    incremental: bool = False
+
+class PipelineRequest(BaseModel):
+    topic: str
+    notebook_count: int = Field(..., ge=1, le=20)
+    bypass_cache: bool = False
+    context_mode: Literal["cell", "notebook"] = "cell"
 
 class NotebookResponse(BaseModel):
     cells: List[str]
@@ -74,6 +89,7 @@ class CellRequest(BaseModel):
     topic: str
     prompt: str
     type: str
+    bypass_cache: bool = False
 
     @field_validator('type')
     def validate_cell_type(cls, value):
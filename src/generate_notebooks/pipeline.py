@@ -0,0 +1,198 @@
+import asyncio
+import io
+import logging
+import os
+import re
+import time
+import uuid
+import zipfile
+
+import nbformat
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from generate_notebooks.models import NotebookRequest, NotebookStructure, PipelineRequest
+from generate_notebooks.router import build_structure, build_topics, generate_cells
+from generate_notebooks.utils import create_notebook, retrieve_context, retrieve_contexts, sse_event, SSE_HEADERS
+from common.token_budget import usage_label
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+RESULT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+async def run_pipeline(request: PipelineRequest, emit):
+    """
+    Generate a whole course: topics, then a structure per topic, then every
+    cell of every notebook.
+
+    Each notebook moves to its cells as soon as its own structure is ready,
+    with at most PIPELINE_NOTEBOOK_CONCURRENCY notebooks in flight and one
+    CELL_CONCURRENCY limit shared by all their cells. Structure contexts are
+    retrieved for all topics in one batch and reused as the cell context in
+    "notebook" mode. `emit(event, data)` is awaited on every step.
+
+    A notebook that fails is reported with a "notebook_error" event while
+    the others carry on. Returns one structure per topic in course order,
+    None where the notebook failed; raises the first error when every
+    notebook failed.
+    """
+    usage_label.set(request.topic)
+    topic_context = await retrieve_context(
+        request.topic, top_k=Config.TOP_K_TOPICS, token_budget=Config.CONTEXT_TOKENS_TOPICS
+    )
+    topics = await build_topics(request.topic, request.notebook_count, topic_context)
+    await emit("topics", {"topics": topics})
+
+    structure_contexts = await retrieve_contexts(
+        topics, top_k=Config.TOP_K_STRUCTURE, token_budget=Config.CONTEXT_TOKENS_STRUCTURE
+    )
+    notebook_semaphore = asyncio.Semaphore(Config.PIPELINE_NOTEBOOK_CONCURRENCY)
+    cell_semaphore = asyncio.Semaphore(Config.CELL_CONCURRENCY)
+
+    async def notebook(index, topic, context):
+        async with notebook_semaphore:
+            try:
+                usage_label.set(f"{request.topic} / {topic}")
+                structure = NotebookStructure(**await build_structure(topic, context))
+                await emit("structure", {"notebook": index, "structure": structure.model_dump()})
+
+                async def on_event(event, data):
+                    if event == "done":
+                        await emit("cell", {"notebook": index, **data})
+
+                cells_request = NotebookRequest(
+                    structure=structure, bypass_cache=request.bypass_cache, context_mode=request.context_mode
+                )
+                await generate_cells(cells_request, cell_semaphore, on_event, shared_context=context)
+                await emit("notebook", {
+                    "notebook": index,
+                    "notebook_name": structure.notebook_name,
+                    "failed_cells": sum(cell.error is not None for cell in structure.cells),
+                })
+                return structure
+            except Exception as error:
+                logger.exception("Notebook %d (%s) of pipeline %s failed", index, topic, request.topic)
+                await emit("notebook_error", {
+                    "notebook": index, "topic": topic, "error": str(error) or type(error).__name__
+                })
+                raise
+
+    # One notebook's failure leaves its siblings running; cancelling the pipeline cancels them all
+    results = await asyncio.gather(*(
+        notebook(index, topic, context)
+        for index, (topic, context) in enumerate(zip(topics, structure_contexts))
+    ), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if len(errors) == len(results):
+        raise errors[0]
+    return [None if isinstance(result, BaseException) else result for result in results]
+
+
+def failed_notebooks(structures) -> list[int]:
+    return [index for index, structure in enumerate(structures) if structure is None]
+
+
+def notebook_filename(index: int, name: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_") or "notebook"
+    return f"{index + 1:02d}_{slug}.ipynb"
+
+
+def build_zip(structures) -> bytes:
+    """
+    Zip the notebooks in course order, one .ipynb per structure; failed
+    notebooks are left out but keep their numbers.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for index, structure in enumerate(structures):
+            if structure is None:
+                continue
+            notebook = create_notebook(structure.cells)
+            archive.writestr(notebook_filename(index, structure.notebook_name), nbformat.writes(notebook))
+    return buffer.getvalue()
+
+
+def save_result(content: bytes) -> str:
+    """
+    Keep a finished zip for download and drop the ones older than PIPELINE_RESULT_TTL_SECONDS.
+    """
+    os.makedirs(Config.PIPELINE_RESULTS_DIR, exist_ok=True)
+    expired = time.time() - Config.PIPELINE_RESULT_TTL_SECONDS
+    for entry in os.scandir(Config.PIPELINE_RESULTS_DIR):
+        if entry.name.endswith(".zip") and entry.stat().st_mtime < expired:
+            os.remove(entry.path)
+
+    result_id = uuid.uuid4().hex
+    path = os.path.join(Config.PIPELINE_RESULTS_DIR, f"{result_id}.zip")
+    with open(path + ".tmp", "wb") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+    return result_id
+
+
+def zip_filename(topic: str) -> str:
+    return (re.sub(r"[^A-Za-z0-9]+", "_", topic).strip("_") or "notebooks") + ".zip"
+
+
+@router.post("/generate_pipeline")
+async def generate_pipeline(request: PipelineRequest):
+    async def emit(event, data):
+        pass
+
+    structures = await run_pipeline(request, emit)
+    content = await asyncio.to_thread(build_zip, structures)
+    headers = {"Content-Disposition": f"attachment; filename={zip_filename(request.topic)}"}
+    failed = failed_notebooks(structures)
+    if failed:
+        # Zero-based notebook indices, as in the stream's events
+        headers["X-Failed-Notebooks"] = ",".join(map(str, failed))
+    return Response(content=content, media_type="application/zip", headers=headers)
+
+
+@router.post("/generate_pipeline/stream")
+async def generate_pipeline_stream(request: PipelineRequest):
+    queue = asyncio.Queue()
+
+    async def emit(event, data):
+        await queue.put((event, data))
+
+    async def run():
+        try:
+            return await run_pipeline(request, emit)
+        finally:
+            await queue.put(None)
+
+    async def events():
+        task = asyncio.create_task(run())
+        try:
+            while (item := await queue.get()) is not None:
+                yield sse_event(*item)
+            try:
+                structures = await task
+            except Exception as error:
+                logger.exception("Pipeline for %s failed", request.topic)
+                yield sse_event("error", {"error": str(error) or type(error).__name__})
+                return
+            content = await asyncio.to_thread(build_zip, structures)
+            result_id = await asyncio.to_thread(save_result, content)
+            yield sse_event("complete", {
+                "result_id": result_id,
+                "notebooks": [structure.notebook_name if structure else None for structure in structures],
+                "failed_notebooks": failed_notebooks(structures),
+            })
+        finally:
+            # Client went away mid-stream: stop paying for the remaining notebooks
+            task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/pipeline_results/{result_id}")
+async def get_pipeline_result(result_id: str):
+    path = os.path.join(Config.PIPELINE_RESULTS_DIR, f"{result_id}.zip")
+    if not RESULT_ID.match(result_id) or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail='Result not found')
+    return FileResponse(path, media_type="application/zip", filename=f"{result_id}.zip")
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+
+from config import Config
+from common.token_budget import token_counter
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = Path(__file__).parent / "prompts"
+# System prompt of cell types without a template of their own
+DEFAULT_TEMPLATE = "default"
+
+
+def counter_encoding() -> str:
+    """
+    Name of the encoding token_counter counts in, or "estimate" when tiktoken is unavailable.
+    """
+    return token_counter.encoding_name if token_counter.encoding is not None else "estimate"
+
+
+class PromptRegistry:
+    """
+    Cell system prompts, read once per process from prompts/<version>/ on first use.
+
+    Each cell type has one template file, so the system message that opens
+    every cell request is the same bytes for a type whichever endpoint builds
+    it, a prefix the provider's prompt caching can reuse. manifest.json pins
+    each template's sha256 and token count: templates are edited by adding a
+    new version directory, and `check` reports any drift from the manifest.
+    """
+
+    def __init__(self, version: str, directory: Path = PROMPTS_DIR):
+        self.version = version
+        self.directory = directory / version
+        self._lock = threading.Lock()
+        self._templates = None
+        self._digests = None
+        self._manifest = None
+
+    def _load(self):
+        # Templates are read on first use rather than at import
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    templates = {
+                        path.stem: path.read_text(encoding="utf-8") for path in sorted(self.directory.glob("*.txt"))
+                    }
+                    if DEFAULT_TEMPLATE not in templates:
+                        raise FileNotFoundError(f"No {DEFAULT_TEMPLATE}.txt prompt template in {self.directory}")
+                    self._digests = {
+                        name: hashlib.sha256(text.encode("utf-8")).hexdigest() for name, text in templates.items()
+                    }
+                    manifest_path = self.directory / "manifest.json"
+                    self._manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {"templates": {}}
+                    self._templates = templates
+                    for problem in self.check(count_tokens=False):
+                        logger.warning("Prompt templates %s: %s", self.version, problem)
+
+    @property
+    def templates(self) -> dict:
+        self._load()
+        return self._templates
+
+    @property
+    def digests(self) -> dict:
+        self._load()
+        return self._digests
+
+    @property
+    def manifest(self) -> dict:
+        self._load()
+        return self._manifest
+
+    @manifest.setter
+    def manifest(self, manifest: dict):
+        self._load()
+        self._manifest = manifest
+
+    def template_name(self, cell_type: str) -> str:
+        return cell_type if cell_type in self.templates else DEFAULT_TEMPLATE
+
+    def system_prompt(self, cell_type: str) -> str:
+        return self.templates[self.template_name(cell_type)]
+
+    def digest(self, cell_type: str) -> str:
+        return self.digests[self.template_name(cell_type)]
+
+    def tokens(self, cell_type: str) -> int:
+        """
+        Precomputed token count of the cell type's system prompt, from the manifest.
+        """
+        name = self.template_name(cell_type)
+        recorded = self.manifest["templates"].get(name)
+        return recorded["tokens"] if recorded else token_counter.count(self.templates[name])
+
+    def build_manifest(self) -> dict:
+        return {
+            "version": self.version,
+            "encoding": counter_encoding(),
+            "templates": {
+                name: {"sha256": self.digests[name], "tokens": token_counter.count(text)}
+                for name, text in self.templates.items()
+            },
+        }
+
+    def check(self, count_tokens: bool = True) -> list[str]:
+        """
+        Describe every way the templates on disk differ from the manifest; empty when they agree.
+
+        With `count_tokens`, a manifest counted in another encoding than the
+        one token_counter has loaded is a problem in itself, since its counts
+        can't be checked.
+        """
+        problems = []
+        recorded = self.manifest["templates"]
+        compare_tokens = count_tokens and self.manifest.get("encoding") == counter_encoding()
+        if count_tokens and not compare_tokens:
+            problems.append(
+                f"manifest.json counts tokens in {self.manifest.get('encoding')} but they are counted in "
+                f"{counter_encoding()} here; load {Config.TOKEN_ENCODING} with tiktoken to check them"
+            )
+        for name in sorted(set(self.templates) | set(recorded)):
+            if name not in recorded:
+                problems.append(f"{name}.txt is not in manifest.json")
+            elif name not in self.templates:
+                problems.append(f"{name} is in manifest.json but {name}.txt is missing")
+            elif recorded[name]["sha256"] != self.digests[name]:
+                problems.append(f"{name}.txt changed since manifest.json was written; add a new version instead")
+            elif compare_tokens and recorded[name]["tokens"] != token_counter.count(self.templates[name]):
+                problems.append(
+                    f"{name}.txt is {token_counter.count(self.templates[name])} tokens, "
+                    f"manifest.json says {recorded[name]['tokens']}"
+                )
+        return problems
+
+
+prompt_registry = PromptRegistry(Config.PROMPT_VERSION)
@@ -1,20 +1,34 @@
+import asyncio
 import json
+import logging
 
 from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from generate_notebooks.models import (
     NotebookRequest, NotebookResponse, StructureFeedbackRequest,
     StructureRequest, StructureResponse, TopicFeedbackRequest,
     TopicRequest, TopicResponse, CellRequest, AllCellsResponse,
-    CellResponse, CELL_TYPES
+    CellResponse, Cell, CELL_TYPES
 )
-from generate_notebooks.utils import retrieve_context, create_notebook
-from openai import OpenAI
+from generate_notebooks.prompts import prompt_registry
+from generate_notebooks.utils import (
+    retrieve_context, retrieve_contexts, create_notebook, create_completion, complete_text, stream_completion,
+    sse_event, SSE_HEADERS
+)
+from common.token_budget import token_counter, usage_label
+from common.completion_cache import cell_cache
+from common.retrieval import corpus
+from common.single_flight import request_key, single_flight
+from config import Config
 import nbformat
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Model behind every generated cell; part of the cell fingerprint
+CELL_MODEL = "gpt-4o"
+
 @router.post("/generate_notebook", response_model=NotebookResponse)
 async def generate_notebook(request: NotebookRequest):
 
@@ -28,243 +42,270 @@ async def generate_notebook(request: NotebookRequest):
         }
     )
 
+def cell_messages(cell_type: str, topic: str, prompt: str, context: str):
+    """
+    Messages for generating one cell. The system prompt comes verbatim from
+    the prompt registry, and the cell's own prompt goes last, so cells of a
+    notebook that share a context also share everything before it.
+    """
+    return [
+        {"role": "system", "content": prompt_registry.system_prompt(cell_type)},
+        {"role": "user", "content": f"Topic: {topic}\n\nContext:\n{context}\n\nPrompt: {prompt}"},
+    ]
+
 @router.post("/generate_cell_content", response_model=CellResponse)
 async def generate_cell(request: CellRequest):
-
-    context = retrieve_context(request.topic)
-        # Choose the appropriate system prompt based on the cell type
-    if request.type == "short_paragraph":
-        system_prompt = (
-            """
-            You are an expert in creating educational Jupyter notebooks for university-level students. 
-            Generate a short, engaging paragraph (2-5 sentences) introducing the given concept. 
-            - Start with a real-world analogy or an intuitive explanation before introducing technical terms.
-            - Avoid jargon initially, and introduce formulas or definitions only after setting the intuition.
-            - The explanation should be clear, concise, and self-contained without extra commentary.
-            """
-        )
-    elif request.type == "bullet_points":
-        system_prompt = (
-            """
-            You are an expert in creating educational Jupyter notebooks for university students. 
-            Generate a set of bullet points summarizing the concept based on the given topic. 
-            - Keep each bullet clear, concise, and focused on one key idea.
-            - If relevant, include real-world applications or examples to reinforce understanding.
-            - Use a logical order, ensuring the points build on each other progressively.
-            """
-        )
-    elif request.type == "numbered_list":
-        system_prompt = (
-            """
-            You are an expert in creating structured, step-by-step educational content. 
-            Generate a numbered list explaining the given concept in a progressive and logical order. 
-            - Each step should be clear, self-contained, and build upon the previous one.
-            - Avoid skipping intermediate steps—assume the reader is new to the topic.
-            - If applicable, connect the steps to a real-world scenario for better comprehension.
-            """
-        )
-    elif request.type == "code_snippet":
-        system_prompt = (
-            """
-            You are an expert in creating educational Jupyter notebooks for university students. 
-            Generate a concise Python code snippet that demonstrates the given concept. 
-            - The code should be beginner-friendly with inline comments explaining each step.
-            - Ensure all necessary imports are included for a fully self-contained example.
-            - Use simple, clear logic rather than unnecessary complexity.
-            - Avoid excessive print statements; use structured output when relevant.
-            - only include code and not any other text
-            - Remove the explicit "```python" directions.
-            """     
-        )
-    elif request.type == "code_with_output":
-        system_prompt = (
-            """
-            You are an expert in creating educational Jupyter notebooks for university students. 
-            Generate a Python code snippet that produces visible output demonstrating the given concept. 
-            - Ensure expected output is included (either as printed results or as comments).
-            - Add inline comments explaining key operations.
-            - Keep the example clear, simple, and easy to follow without unnecessary complexity.
-            - only include code and not any other text
-            - Remove the explicit "```python" directions.
-            """
-        )
-    elif request.type == "code_with_visualization":
-        system_prompt = (
-            """
-            You are an expert in creating educational Jupyter notebooks for university students. 
-            Generate a Python code snippet that creates a visualization (e.g., a chart, plot, or graph) to illustrate the concept. 
-            - Ensure all necessary imports are included (e.g., Matplotlib, Seaborn).
-            - Generate the visualization step by step (first raw data, then any modifications like regression lines).
-            - Include axis labels, titles, and legends for clarity.
-            - Avoid using external utility functions—make the code self-contained.
-            - only include code and not any other text
-            - Remove the explicit "```python" directions.
-            """
-        )
-    elif request.type == "multiple_paragraphs":
-        system_prompt = ("""
-            You are an expert in creating educational Jupyter notebooks for university-level students. 
-            Generate detailed Markdown content (a few paragraphs) providing an in-depth explanation or description of the given concept. 
-
-            Content Guidelines:
-            - **Start with an intuitive explanation or real-world analogy** before introducing technical details.
-            - **Use clear, structured paragraphs** to break down the concept logically.
-            - **Introduce definitions and equations progressively**, ensuring a smooth transition between ideas.
-            - If applicable, **explain real-world applications** of the concept.
-            - **Use headings and subheadings where necessary** to enhance readability.
-            - **Keep the explanation self-contained and beginner-friendly**, assuming the reader has no prior knowledge.
-
-            Return only the Markdown-formatted content without any extra notes.
-            """
+    usage_label.set(request.topic)
+
+    async def compute():
+        context = await retrieve_context(request.topic, top_k=Config.TOP_K_CELL, token_budget=Config.CONTEXT_TOKENS_CELL)
+        return await complete_text(
+            bypass_cache=request.bypass_cache,
+            model=CELL_MODEL,
+            messages=cell_messages(request.type, request.topic, request.prompt, context),
         )
+
+    # Double-clicks and client retries share one retrieval and completion
+    cell_content = await single_flight.run(request_key("generate_cell_content", request.model_dump()), compute)
+    return CellResponse(content=cell_content)
+
+@router.post("/generate_cell_content/stream")
+async def generate_cell_stream(request: CellRequest):
+
+    async def events():
+        usage_label.set(request.topic)
+        context = await retrieve_context(request.topic, top_k=Config.TOP_K_CELL, token_budget=Config.CONTEXT_TOKENS_CELL)
+        content = ""
+        async for delta in stream_completion(
+            bypass_cache=request.bypass_cache,
+            model=CELL_MODEL,
+            messages=cell_messages(request.type, request.topic, request.prompt, context),
+        ):
+            content += delta
+            yield sse_event("delta", {"content": delta})
+        yield sse_event("done", CellResponse(content=content).model_dump())
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def cell_query(notebook_name: str, cell: Cell, context_mode: str) -> str:
+    """
+    Retrieval query for a cell's context; in "notebook" mode every cell shares the notebook's.
+    """
+    return notebook_name if context_mode == "notebook" else f"{notebook_name}: {cell.prompt}"
+
+def cell_fingerprint(
+    cell: Cell, notebook_name: str, corpus_fingerprint: str, context_mode: str, shared_context: str = None
+) -> str:
+    """
+    Digest of everything a generated cell depends on: its messages before
+    the context is filled in, and the retrieval that fills it in. It keys
+    the cell cache, so content generated for a fingerprint can be restored
+    without an LLM call.
+    """
+    if context_mode == "notebook" and shared_context is not None:
+        retrieval = {"shared_context": shared_context}
     else:
-        system_prompt = (
-            "You are an expert in creating educational Jupyter notebooks for university level students. "
-            "Generate cell content based on the given topic, prompt, and context. Make sure it is clear, concise, and directly addresses the subject. "
-            "Return only the cell content without extra text."
-            " Add headings if needed"
+        retrieval = {
+            "query": cell_query(notebook_name, cell, context_mode),
+            "top_k": Config.TOP_K_ALL_CELLS,
+            "token_budget": Config.CONTEXT_TOKENS_ALL_CELLS,
+            "min_passage_tokens": Config.CONTEXT_MIN_PASSAGE_TOKENS,
+            "hybrid": Config.HYBRID_RETRIEVAL,
+            "rerank_model": Config.RERANK_MODEL,
+            "corpus": corpus_fingerprint,
+        }
+    return cell_cache.key({
+        "model": CELL_MODEL,
+        "cell_type": cell.type,
+        "system_prompt": prompt_registry.digest(cell.type),
+        "topic": notebook_name,
+        "prompt": cell.prompt,
+        "context_mode": context_mode,
+        "retrieval": retrieval,
+    })
+
+async def plan_cells(request: NotebookRequest, shared_context: str = None):
+    """
+    Fingerprint every cell and return the fingerprints with the indices of
+    the cells that need generating.
+
+    Outside incremental mode that is every cell. In incremental mode a
+    generated cell whose fingerprint is unchanged is returned untouched, and
+    a cell whose fingerprint was generated before (for example one that
+    survived a structure edit) is filled from the completion cache.
+    """
+    structure = request.structure
+    for cell in structure.cells:
+        # The first generation overwrites content, so keep the prompt it was generated from
+        if cell.prompt is None:
+            cell.prompt = cell.content
+    corpus_fingerprint = await corpus.fingerprint()
+    fingerprints = [
+        cell_fingerprint(cell, structure.notebook_name, corpus_fingerprint, request.context_mode, shared_context)
+        for cell in structure.cells
+    ]
+    if not request.incremental:
+        return fingerprints, list(range(len(structure.cells)))
+
+    candidates = [
+        index for index, (cell, fingerprint) in enumerate(zip(structure.cells, fingerprints))
+        if not (cell.generated and cell.fingerprint == fingerprint)
+    ]
+    if request.bypass_cache:
+        return fingerprints, candidates
+    cached = await asyncio.gather(*(asyncio.to_thread(cell_cache.get, fingerprints[index]) for index in candidates))
+    pending = []
+    for index, content in zip(candidates, cached):
+        if content is None:
+            pending.append(index)
+            continue
+        cell = structure.cells[index]
+        cell.content = content
+        cell.generated = True
+        cell.loading = False
+        cell.error = None
+        cell.fingerprint = fingerprints[index]
+    return fingerprints, pending
+
+async def cell_contexts(request: NotebookRequest, cells):
+    """
+    Context for each of `cells`, in order.
+    """
+    structure = request.structure
+    if request.context_mode == "notebook":
+        context = await retrieve_context(
+            cell_query(structure.notebook_name, None, "notebook"),
+            top_k=Config.TOP_K_ALL_CELLS, token_budget=Config.CONTEXT_TOKENS_ALL_CELLS
         )
-
-    client = OpenAI()
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": (
-                    f"Topic: {request.topic}\n\n"
-                    f"Prompt: {request.prompt}\n\n"
-                    f"Context:\n{context}"
-                ),
-            },
-        ],
+        return [context] * len(cells)
+    return await retrieve_contexts(
+        [cell_query(structure.notebook_name, cell, request.context_mode) for cell in cells],
+        top_k=Config.TOP_K_ALL_CELLS, token_budget=Config.CONTEXT_TOKENS_ALL_CELLS
     )
-    cell_content = response.choices[0].message.content
-    return CellResponse(content=cell_content)
+
+async def generate_cells(
+    request: NotebookRequest, semaphore: asyncio.Semaphore, on_event=None, shared_context: str = None,
+    stream: bool = False
+):
+    """
+    Generate the cells of `request.structure` that plan_cells selects, in
+    place and at most `semaphore` at a time. Returns how many were generated.
+
+    A failed cell keeps its prompt and gets an `error` instead of failing the
+    notebook. `on_event(event, data)` is awaited with "started" when a cell
+    starts, "delta" for each piece of its content when `stream` is set, and
+    "done" when it finishes however it finishes; cells that are left as they
+    are get "done" right away. In "notebook" context mode `shared_context`
+    is used instead of retrieving one.
+    """
+    structure = request.structure
+
+    async def emit(event, data):
+        if on_event is not None:
+            await on_event(event, data)
+
+    fingerprints, pending = await plan_cells(request, shared_context)
+    for index, cell in enumerate(structure.cells):
+        if index not in pending:
+            await emit("done", {"index": index, "cell": cell.model_dump()})
+    if request.context_mode == "notebook" and shared_context is not None:
+        contexts = [shared_context] * len(pending)
+    else:
+        contexts = await cell_contexts(request, [structure.cells[index] for index in pending])
+
+    async def generate(index, cell, context):
+        async with semaphore:
+            try:
+                messages = cell_messages(cell.type, structure.notebook_name, cell.prompt or cell.content, context)
+                cell.loading = True
+                cell.generated = False
+                await emit("started", {"index": index, "cell": cell.model_dump()})
+                if stream:
+                    content = ""
+                    async for delta in stream_completion(
+                        bypass_cache=request.bypass_cache, model=CELL_MODEL, messages=messages
+                    ):
+                        content += delta
+                        await emit("delta", {"index": index, "content": delta})
+                else:
+                    content = await complete_text(bypass_cache=request.bypass_cache, model=CELL_MODEL, messages=messages)
+                cell.content = content
+                cell.generated = True
+                cell.error = None
+                cell.fingerprint = fingerprints[index]
+                await asyncio.to_thread(cell_cache.put, fingerprints[index], content, 0)
+            except Exception as error:
+                logger.warning("Failed to generate cell %d of %s: %r", index, structure.notebook_name, error)
+                cell.generated = False
+                cell.error = str(error) or type(error).__name__
+            finally:
+                cell.loading = False
+                await emit("done", {"index": index, "cell": cell.model_dump()})
+
+    await asyncio.gather(*(generate(index, structure.cells[index], context) for index, context in zip(pending, contexts)))
+    return len(pending)
 
 @router.post("/generate_all_cells", response_model=AllCellsResponse)
 async def generate_all_cells(request: NotebookRequest):
-    client = OpenAI()
-    context = retrieve_context(request.structure.notebook_name)
-    updated_notebook = request.structure
-
-    for index, cell in enumerate(request.structure.cells):
-        # Choose the appropriate system prompt based on the cell type
-        if cell.type == "short_paragraph":
-            system_prompt = (
-                """
-                You are an expert in creating educational Jupyter notebooks for university-level students. 
-                Generate a short, engaging paragraph (2-5 sentences) introducing the given concept. 
-                - Start with a real-world analogy or an intuitive explanation before introducing technical terms.
-                - Avoid jargon initially, and introduce formulas or definitions only after setting the intuition.
-                - The explanation should be clear, concise, and self-contained without extra commentary.
-                """
-            )
-        elif cell.type == "bullet_points":
-            system_prompt = (
-                """
-                You are an expert in creating educational Jupyter notebooks for university students. 
-                Generate a set of bullet points summarizing the concept based on the given topic. 
-                - Keep each bullet clear, concise, and focused on one key idea.
-                - If relevant, include real-world applications or examples to reinforce understanding.
-                - Use a logical order, ensuring the points build on each other progressively.
-                """
-            )
-        elif cell.type == "numbered_list":
-            system_prompt = (
-                """
-                You are an expert in creating structured, step-by-step educational content. 
-                Generate a numbered list explaining the given concept in a progressive and logical order. 
-                - Each step should be clear, self-contained, and build upon the previous one.
-                - Avoid skipping intermediate steps—assume the reader is new to the topic.
-                - If applicable, connect the steps to a real-world scenario for better comprehension.
-                """
-            )
-        elif cell.type == "code_snippet":
-            system_prompt = (
-                """
-                You are an expert in creating educational Jupyter notebooks for university students. 
-                Generate a concise Python code snippet that demonstrates the given concept. 
-                - The code should be beginner-friendly with inline comments explaining each step.
-                - Ensure all necessary imports are included for a fully self-contained example.
-                - Use simple, clear logic rather than unnecessary complexity.
-                - Avoid excessive print statements; use structured output when relevant.
-                - only include code and not any other text
-                - Remove the explicit "```python" directions.
-                """     
-            )
-        elif cell.type == "code_with_output":
-            system_prompt = (
-                """
-                You are an expert in creating educational Jupyter notebooks for university students. 
-                Generate a Python code snippet that produces visible output demonstrating the given concept. 
-                - Ensure expected output is included (either as printed results or as comments).
-                - Add inline comments explaining key operations.
-                - Keep the example clear, simple, and easy to follow without unnecessary complexity.
-                - only include code and not any other text
-                - Remove the explicit "```python" directions.   
-                """
-            )
-        elif cell.type == "code_with_visualization":
-            system_prompt = (
-                """
-                You are an expert in creating educational Jupyter notebooks for university students. 
-                Generate a Python code snippet that creates a visualization (e.g., a chart, plot, or graph) to illustrate the concept. 
-                - Ensure all necessary imports are included (e.g., Matplotlib, Seaborn).
-                - Generate the visualization step by step (first raw data, then any modifications like regression lines).
-                - Include axis labels, titles, and legends for clarity.
-                - only include code and not any other text
-                - Remove the explicit "```python" directions.
-                """
-            )
-        elif cell.type == "multiple_paragraphs":
-            system_prompt = ("""
-                You are an expert in creating educational Jupyter notebooks for university-level students. 
-                Generate detailed Markdown content (a few paragraphs) providing an in-depth explanation or description of the given concept. 
-
-                Content Guidelines:
-                - **Start with an intuitive explanation or real-world analogy** before introducing technical details.
-                - **Use clear, structured paragraphs** to break down the concept logically.
-                - **Introduce definitions and equations progressively**, ensuring a smooth transition between ideas.
-                - If applicable, **explain real-world applications** of the concept.
-                - **Use headings and subheadings where necessary** to enhance readability.
-                - **Keep the explanation self-contained and beginner-friendly**, assuming the reader has no prior knowledge.
-
-                Return only the Markdown-formatted content without any extra notes.
-                """
+    usage_label.set(request.structure.notebook_name)
+    semaphore = asyncio.Semaphore(Config.CELL_CONCURRENCY)
+    await generate_cells(request, semaphore)
+    return AllCellsResponse(structure=request.structure)
+
+@router.post("/generate_all_cells/stream")
+async def generate_all_cells_stream(request: NotebookRequest):
+    semaphore = asyncio.Semaphore(Config.CELL_CONCURRENCY)
+    # Events are queued rather than yielded so cells can interleave on the wire
+    queue = asyncio.Queue()
+
+    async def on_event(event, data):
+        await queue.put((event, data))
+
+    async def run():
+        usage_label.set(request.structure.notebook_name)
+        try:
+            await generate_cells(request, semaphore, on_event, stream=True)
+        finally:
+            await queue.put(None)
 
-            )
-        else:
-            system_prompt = (
-                "You are an expert in creating educational Jupyter notebooks for university level students. "
-                "Generate cell content based on the given topic, prompt, and context. Make sure it is clear, concise, and directly addresses the subject. "
-                "Return only the cell content without extra text."
-                " Add headings if needed"
-            )
-          
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": f"Topic: {request.structure.notebook_name}\n\nPrompt: {cell.content}\n\nContext:\n{context}",
-                },
-            ],
-        )
-        updated_notebook.cells[index].content = response.choices[0].message.content
-        updated_notebook.cells[index].generated = True
-    return AllCellsResponse(structure=updated_notebook)
-    
+    async def events():
+        task = asyncio.create_task(run())
+        try:
+            while (item := await queue.get()) is not None:
+                yield sse_event(*item)
+            try:
+                await task
+            except Exception as error:
+                logger.exception("Generating cells of %s failed", request.structure.notebook_name)
+                yield sse_event("error", {"error": str(error) or type(error).__name__})
+                return
+            yield sse_event("complete", AllCellsResponse(structure=request.structure).model_dump())
+        finally:
+            # Client went away mid-stream: stop paying for the remaining cells
+            task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @router.post("/generate_structure", response_model=StructureResponse)
 async def generate_notebook_structure(request: StructureRequest):
-    # Retrieve context from Pinecone
-    context = retrieve_context(request.topic)
-    client = OpenAI()
-    response = client.chat.completions.create(
+    usage_label.set(request.topic)
+
+    async def compute():
+        # Retrieve context from Pinecone
+        context = await retrieve_context(
+            request.topic, top_k=Config.TOP_K_STRUCTURE, token_budget=Config.CONTEXT_TOKENS_STRUCTURE
+        )
+        return await build_structure(request.topic, context)
+
+    structure = await single_flight.run(request_key("generate_structure", request.model_dump()), compute)
+    return StructureResponse(structure=structure)
+
+async def build_structure(topic: str, context: str) -> dict:
+    """
+    Ask the model for a notebook structure on `topic`, falling back to a one-cell structure if it can't be parsed.
+    """
+    response = await create_completion(
         model="gpt-4o",
         messages=[
             {
@@ -306,7 +347,7 @@ async def generate_notebook_structure(request: StructureRequest):
             },
             {
                 "role": "user", 
-                "content": f"Topic: {request.topic}\n\nContext:\n{context}"
+                "content": f"Topic: {topic}\n\nContext:\n{context}"
             }
         ],
         response_format={ "type": "json_object" }
@@ -317,7 +358,7 @@ async def generate_notebook_structure(request: StructureRequest):
         
         # Validate structure matches expected interface
         validated_structure = {
-            "notebook_name": structure.get("notebook_name", f"{request.topic} Notebook"),
+            "notebook_name": structure.get("notebook_name", f"{topic} Notebook"),
             "cells": []
         }
 
@@ -333,11 +374,11 @@ async def generate_notebook_structure(request: StructureRequest):
 
             validated_structure["cells"].append(validated_cell)
             
-        return StructureResponse(structure=validated_structure)
+        return validated_structure
     except json.JSONDecodeError:
         # Fallback to a default structure if JSON parsing fails
         default_structure = {
-            "notebook_name": f"{request.topic} Notebook",
+            "notebook_name": f"{topic} Notebook",
             "cells": [
                 {
                     "type": "short_paragraph",
@@ -345,11 +386,11 @@ async def generate_notebook_structure(request: StructureRequest):
                 }
             ]
         }
-        return StructureResponse(structure=default_structure)
+        return default_structure
     except Exception:
             # Fallback for any other error
             default_structure = {
-                "notebook_name": f"{request.topic} Notebook",
+                "notebook_name": f"{topic} Notebook",
                 "cells": [
                     {
                         "type": "short_paragraph",
@@ -357,13 +398,23 @@ async def generate_notebook_structure(request: StructureRequest):
                     }
                 ]
             }
-            return StructureResponse(structure=default_structure)
+            return default_structure
     
+def compact_structure(structure: str) -> str:
+    """
+    Re-serialize a JSON structure without indentation and cut it to the feedback token budget.
+    """
+    try:
+        structure = json.dumps(json.loads(structure), separators=(",", ":"), ensure_ascii=False)
+    except json.JSONDecodeError:
+        pass
+    return token_counter.truncate(structure, Config.FEEDBACK_STRUCTURE_TOKENS)
+
 @router.post("/generate_feedback_structure", response_model=StructureResponse)
 async def generate_feedback_notebook_structure(request: StructureFeedbackRequest):
     # Optionally retrieve context based on the topic (if available in the request)
-    client = OpenAI()
-    response = client.chat.completions.create(
+    structure = compact_structure(request.structure)
+    response = await create_completion(
         model="gpt-4o",
         messages=[
             {
@@ -384,7 +435,7 @@ async def generate_feedback_notebook_structure(request: StructureFeedbackRequest
             },
             {
                 "role": "user", 
-                "content": f"Initial Structure:\n{request.structure}\n\nFeedback:\n{request.feedback}"
+                "content": f"Initial Structure:\n{structure}\n\nFeedback:\n{request.feedback}"
             }
         ],
         response_format={ "type": "json_object" }
@@ -448,13 +499,22 @@ def validate_structure(structure: dict) -> bool:
 
 @router.post("/generate_topics", response_model=TopicResponse)
 async def generate_notebook_topics(request: TopicRequest):
+    usage_label.set(request.topic)
 
-    context = retrieve_context(request.topic)
-    client = OpenAI()
-    
+    async def compute():
+        context = await retrieve_context(request.topic, top_k=Config.TOP_K_TOPICS, token_budget=Config.CONTEXT_TOKENS_TOPICS)
+        return await build_topics(request.topic, request.notebook_count, context)
+
+    topics = await single_flight.run(request_key("generate_topics", request.model_dump()), compute)
+    return TopicResponse(topics=topics)
+
+async def build_topics(topic: str, notebook_count: int, context: str) -> list[str]:
+    """
+    Ask the model for `notebook_count` subtopics of `topic`, retrying invalid JSON before falling back to numbered parts.
+    """
     max_retries = 3
     for attempt in range(max_retries):
-        response = client.chat.completions.create(
+        response = await create_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -480,7 +540,7 @@ async def generate_notebook_topics(request: TopicRequest):
                 },
                 {
                     "role": "user", 
-                    "content": f"Topic: {request.topic}\n\nNotebook Count: {request.notebook_count}\n\nContext:\n{context}"
+                    "content": f"Topic: {topic}\n\nNotebook Count: {notebook_count}\n\nContext:\n{context}"
                 }
             ],
             response_format={ "type": "json_object" }
@@ -489,22 +549,21 @@ async def generate_notebook_topics(request: TopicRequest):
         try:
             structure = json.loads(response.choices[0].message.content)
             if validate_structure(structure):
-                return TopicResponse(topics=structure["topics"])
+                return structure["topics"]
         except json.JSONDecodeError:
             continue
             
     # Fallback structure if all retries fail
     default_structure = {
-        "topics": [f"{request.topic} Part {i+1}" for i in range(request.notebook_count)]
+        "topics": [f"{topic} Part {i+1}" for i in range(notebook_count)]
     }
-    return TopicResponse(topics=default_structure["topics"])
+    return default_structure["topics"]
 
 @router.post("/generate_feedback_topics", response_model=TopicResponse)
 async def generate_feedback_notebook_topics(request: TopicFeedbackRequest):
-    client = OpenAI()
     max_retries = 3
     for attempt in range(max_retries):
-        response = client.chat.completions.create(
+        response = await create_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -1,43 +1,198 @@
-from openai import OpenAI
-from pinecone import Pinecone
-from config import Config
-from sentence_transformers import SentenceTransformer
+import asyncio
+import json
+import random
+
 from nbformat.v4 import new_notebook, new_markdown_cell, new_code_cell
+from config import Config
+from common.registry import registry
+from common.completion_cache import completion_cache
+from common.retrieval import corpus, reciprocal_rank_fusion, retrieval_cache
+from common.token_budget import token_counter, token_usage
 from generate_notebooks.models import Cell
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
 from generate_notebooks.models import CODE_CELL_TYPES
 
-# Global Initialization for faster performance
-MODEL = SentenceTransformer('all-MiniLM-L6-v2')
-CLIENT = MongoClient(Config.MONGODB_URI, server_api=ServerApi('1'))
 
-# Pinecone Initialization
-pc = Pinecone(api_key=Config.PINECONE_API_KEY)
-index = pc.Index(host="https://fyp-context-0mqoalz.svc.aped-4627-b74a.pinecone.io")
+async def retrieve_context(topic: str, top_k: int = 3, token_budget: int = None):
+    return (await retrieve_contexts([topic], top_k, token_budget))[0]
+
+async def retrieve_contexts(queries, top_k: int = 3, token_budget: int = None):
+    """
+    Retrieve a context for each query with one batched embedding call and
+    one batch of vector queries. Repeated queries are looked up once, and
+    each context is cut to `token_budget` tokens when given.
+    """
+    selected_doc_names = await corpus.selected()
+    # Shared by every worker, so a document re-indexed through another worker misses here too
+    corpus_fingerprint = await corpus.fingerprint()
+    unique_queries = list(dict.fromkeys(queries))
+    query_vectors = await registry.embed(unique_queries)
 
+    cache_keys = [retrieval_cache.key(vector, top_k, corpus_fingerprint) for vector in query_vectors]
+    matches = [retrieval_cache.get(cache_key) for cache_key in cache_keys]
+    missing = [index for index, found in enumerate(matches) if found is None]
+    if missing:
+        results = await search(
+            [unique_queries[index] for index in missing],
+            [query_vectors[index].tolist() for index in missing],
+            top_k, selected_doc_names
+        )
+        for index, result in zip(missing, results):
+            matches[index] = result
+            retrieval_cache.put(cache_keys[index], result)
 
-def retrieve_context(topic: str, top_k: int = 3):
-    documents = CLIENT['fyp']['documents']
-    selected_documents = documents.find({"selected": True})
-    selected_doc_names = [doc["name"] for doc in selected_documents]
+    contexts = dict(zip(unique_queries, (format_context(found, token_budget) for found in matches)))
+    return [contexts[query] for query in queries]
 
-    query_vector = embed_topic(topic)
-    response = index.query(
-        vector=query_vector,
-        top_k=top_k,
-        include_metadata=True,
-        filter={"filename": {"$in": selected_doc_names}}
-    )
-    if not response['matches']:
+async def search(queries, query_vectors, top_k: int, filenames):
+    """
+    Top_k matches per query: dense results, fused with BM25 results by
+    reciprocal rank when hybrid retrieval is on, then optionally reranked
+    by the cross-encoder.
+    """
+    fuse = Config.HYBRID_RETRIEVAL or bool(Config.RERANK_MODEL)
+    candidates = max(top_k, Config.RETRIEVAL_CANDIDATES) if fuse else top_k
+    store = await registry.get_vector_store()
+    searches = [asyncio.to_thread(store.query_many, query_vectors, candidates, filenames=filenames)]
+    if Config.HYBRID_RETRIEVAL:
+        lexical_index = await registry.get_lexical_index()
+        searches.append(asyncio.to_thread(lexical_index.query_many, queries, candidates, filenames=filenames))
+    rankings = await asyncio.gather(*searches)
+    if not fuse:
+        return rankings[0]
+
+    fused = [reciprocal_rank_fusion(per_query) for per_query in zip(*rankings)]
+    if not Config.RERANK_MODEL:
+        return [matches[:top_k] for matches in fused]
+    reranked = []
+    for query, matches in zip(queries, fused):
+        scores = await registry.rerank(query, [match['metadata']['text'] for match in matches]) if matches else []
+        order = sorted(range(len(matches)), key=lambda index: scores[index], reverse=True)[:top_k]
+        reranked.append([{**matches[index], 'score': float(scores[index])} for index in order])
+    return reranked
+
+def format_context(matches, token_budget: int = None):
+    """
+    Build a context from ranked matches. Repeated chunks are dropped and the
+    best-ranked ones are kept while they fit in `token_budget`, the last one
+    truncated to fill it. The survivors are joined in document order, merging
+    neighbouring chunks of the same document so the sentences they share as
+    overlap appear only once.
+    """
+    if not matches:
         return 'None'
+    selected = []
+    seen = set()
+    remaining = token_budget
+    for match in matches:
+        text = match['metadata']['text']
+        fingerprint = " ".join(text.split()).lower()
+        if match['id'] in seen or fingerprint in seen:
+            continue
+        seen.update((match['id'], fingerprint))
+        if token_budget is not None:
+            tokens = token_counter.count(text)
+            if tokens > remaining:
+                if remaining >= Config.CONTEXT_MIN_PASSAGE_TOKENS:
+                    truncated = token_counter.truncate(text, remaining)
+                    selected.append({**match, 'metadata': {**match['metadata'], 'text': truncated}})
+                break
+            remaining -= tokens
+        selected.append(match)
+
+    passages = []
+    previous = None
+    for match in sorted(selected, key=lambda match: (match['metadata'].get('filename', ''), match['metadata'].get('chunk_id', 0))):
+        metadata = match['metadata']
+        if (
+            previous is not None
+            and metadata.get('filename') == previous.get('filename')
+            and metadata.get('char_start') is not None and previous.get('char_end') is not None
+            and metadata['char_start'] < previous['char_end']
+        ):
+            passages[-1] = merge_overlap(passages[-1], metadata['text'])
+        else:
+            passages.append(metadata['text'])
+        previous = metadata
+    return "\n\n".join(passages)
+
+def merge_overlap(first: str, second: str) -> str:
+    """
+    Append `second` to `first`, dropping its leading sentences that repeat the end of `first`.
+    """
+    for start in range(max(0, len(first) - len(second)), len(first)):
+        if (start == 0 or first[start - 1] == " ") and second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+    return first + " " + second
+
+async def create_completion(**kwargs):
+    """
+    Call the async chat completions API, retrying rate limits and transient
+    connection errors with exponential backoff and jitter. Token usage of
+    non-streamed responses is recorded here; streams record theirs in
+    stream_completion.
+    """
+    # Imported on first use, like the client itself (see Registry.async_openai)
+    from openai import APIConnectionError, APITimeoutError, RateLimitError
+    for attempt in range(Config.LLM_MAX_RETRIES):
+        try:
+            response = await registry.async_openai.chat.completions.create(**kwargs)
+            if not kwargs.get("stream"):
+                token_usage.record(kwargs.get("model"), response.usage)
+            return response
+        except (RateLimitError, APITimeoutError, APIConnectionError):
+            if attempt == Config.LLM_MAX_RETRIES - 1:
+                raise
+            delay = Config.LLM_RETRY_BASE_DELAY * 2 ** attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+async def complete_text(bypass_cache: bool = False, **kwargs) -> str:
+    """
+    Return the completion text for a request, replaying it from the completion
+    cache when an identical request was answered before. Fresh results are
+    always written back, so a bypassed request refreshes the cached entry.
+    """
+    cache_key = completion_cache.key(kwargs)
+    if not bypass_cache:
+        content = await asyncio.to_thread(completion_cache.get, cache_key)
+        if content is not None:
+            return content
+
+    response = await create_completion(**kwargs)
+    content = response.choices[0].message.content
+    tokens = response.usage.total_tokens if response.usage else 0
+    await asyncio.to_thread(completion_cache.put, cache_key, content, tokens)
+    return content
+
+async def stream_completion(bypass_cache: bool = False, **kwargs):
+    """
+    Stream a chat completion, yielding the text of each token delta as it arrives.
+    A cached completion is replayed as a single delta.
+    """
+    cache_key = completion_cache.key(kwargs)
+    if not bypass_cache:
+        content = await asyncio.to_thread(completion_cache.get, cache_key)
+        if content is not None:
+            yield content
+            return
+
+    stream = await create_completion(stream=True, stream_options={"include_usage": True}, **kwargs)
+    content = ""
+    tokens = 0
+    async for chunk in stream:
+        if chunk.usage:
+            tokens = chunk.usage.total_tokens
+            token_usage.record(kwargs.get("model"), chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            content += chunk.choices[0].delta.content
+            yield chunk.choices[0].delta.content
+    # Only completed streams reach this point; abandoned ones are never cached
+    await asyncio.to_thread(completion_cache.put, cache_key, content, tokens)
 
-    context = "\n\n".join([match['metadata']['text'] for match in response['matches']])
-    return context
+# Stop proxies (nginx in particular) from buffering the event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
-def embed_topic(topic: str):
-    # Reuse the pre-loaded model.
-    return MODEL.encode(topic).tolist()
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 def create_notebook(cells: list[Cell]):
     nb = new_notebook()
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+
+from config import Config
+from common.registry import registry
+
+
+def document_key(filename: str) -> str:
+    """
+    Stable short key for a document, used as the prefix of its vector ids.
+    """
+    return hashlib.sha256(filename.encode()).hexdigest()[:16]
+
+
+def chunk_vector_id(doc_key: str, chunk_id: int) -> str:
+    return f"{doc_key}#{chunk_id}"
+
+
+def chunk_hash(chunk) -> str:
+    """
+    Hash of a chunk's whitespace-normalized text, the only input of its
+    vector: a chunk with a known hash keeps its vector wherever it moved.
+    """
+    return hashlib.sha256(" ".join(chunk.text.split()).encode()).hexdigest()
+
+
+def chunk_placement(chunk) -> list:
+    """
+    Where a chunk sits in its document; a moved chunk needs only this part of its metadata updated.
+    """
+    return [chunk.page, chunk.page_end, chunk.char_start, chunk.char_end]
+
+
+async def load_chunk_entry(filename: str):
+    return await registry.chunk_registry.find_one({'_id': document_key(filename)})
+
+
+async def record_pending(filename: str, vector_ids, moved_ids):
+    """
+    Note in the document's registry entry, before they are written, the
+    vectors an ingest is about to add and the known chunks whose placement it
+    is about to update, so `roll_back_pending` can undo them if the ingest
+    fails. `save_chunk_ids` clears them once the ingest succeeds.
+    """
+    await registry.chunk_registry.update_one(
+        {'_id': document_key(filename)},
+        {
+            '$set': {'filename': filename},
+            '$addToSet': {'pending_ids': {'$each': list(vector_ids)}, 'moved_ids': {'$each': list(moved_ids)}}
+        },
+        upsert=True
+    )
+
+
+async def roll_back_pending(store, filename: str) -> int:
+    """
+    Undo what a failed ingest did to `filename` after its last registry save:
+    delete the vectors it added and move the chunks it moved back to their
+    recorded placement. Returns the number of vectors deleted.
+    """
+    entry = await load_chunk_entry(filename)
+    if entry is None:
+        return 0
+    known_ids = entry.get('vector_ids', [])
+    positions = {vector_id: position for position, vector_id in enumerate(known_ids)}
+    added = [vector_id for vector_id in entry.get('pending_ids', []) if vector_id not in positions]
+    if added:
+        await asyncio.to_thread(delete_in_batches, store, added)
+    moved = set(entry.get('moved_ids', []))
+    placements = entry.get('chunk_placements', [])
+    restored = []
+    if moved and placements:
+        for vector_id, metadata in await asyncio.to_thread(store.fetch_metadata, list(moved)):
+            position = positions[vector_id]
+            page, page_end, char_start, char_end = placements[position]
+            restored.append((vector_id, {
+                **metadata, "page": page, "page_end": page_end, "char_start": char_start, "char_end": char_end,
+                "chunk_id": position,
+            }))
+    if restored:
+        await asyncio.to_thread(store.update_metadata, restored)
+        await asyncio.to_thread(registry.lexical_index.add, restored)
+    await asyncio.to_thread(flush_indexes, store)
+    if known_ids:
+        await registry.chunk_registry.update_one(
+            {'_id': entry['_id']}, {'$unset': {'pending_ids': '', 'moved_ids': ''}}
+        )
+    else:
+        # The entry only existed to track the failed ingest of a new document
+        await registry.chunk_registry.delete_one({'_id': entry['_id']})
+    return len(added)
+
+
+async def save_chunk_ids(filename: str, vector_ids, chunk_hashes=None, chunk_placements=None):
+    """
+    Record the exact vector ids of a document in its chunk registry entry,
+    along with the per-position chunk hashes and placements used for
+    incremental re-indexing.
+    """
+    entry = {'_id': document_key(filename), 'filename': filename, 'vector_ids': list(vector_ids)}
+    if chunk_hashes is not None:
+        entry['chunk_hashes'] = list(chunk_hashes)
+    if chunk_placements is not None:
+        entry['chunk_placements'] = list(chunk_placements)
+    await registry.chunk_registry.replace_one({'_id': entry['_id']}, entry, upsert=True)
+
+
+def delete_in_batches(store, vector_ids, batch_size=Config.DELETE_BATCH_SIZE):
+    for start in range(0, len(vector_ids), batch_size):
+        store.delete(vector_ids[start:start + batch_size])
+    registry.lexical_index.delete(vector_ids)
+
+
+def flush_indexes(store):
+    """
+    Persist the vector store and the lexical index that mirrors it.
+    """
+    store.flush()
+    registry.lexical_index.flush()
+
+
+async def delete_document_vectors(store, filename: str) -> int:
+    """
+    Delete every vector of `filename` using the ids in its registry entry.
+
+    Documents indexed before the registry existed have no entry; they fall
+    back to the store's filename scan until migrated with
+    scripts/migrate_chunk_ids.py. Vectors of an unfinished ingest are
+    deleted along with them.
+    """
+    entry = await registry.chunk_registry.find_one(
+        {'_id': document_key(filename)}, {'vector_ids': 1, 'pending_ids': 1}
+    )
+    if entry is None or 'vector_ids' not in entry:
+        deleted = await asyncio.to_thread(store.delete_by_filename, filename)
+        await asyncio.to_thread(registry.lexical_index.delete_by_filename, filename)
+    else:
+        vector_ids = list(dict.fromkeys(entry['vector_ids'] + entry.get('pending_ids', [])))
+        await asyncio.to_thread(delete_in_batches, store, vector_ids)
+        deleted = len(vector_ids)
+    await asyncio.to_thread(flush_indexes, store)
+    await registry.chunk_registry.delete_one({'_id': document_key(filename)})
+    return deleted
@@ -0,0 +1,143 @@
+import re
+from dataclasses import dataclass
+
+# A sentence ends after terminal punctuation (optionally closed by quotes or
+# brackets) followed by whitespace, or at a blank line (paragraph break).
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])["\')\]]*\s+|\n\s*\n')
+
+
+@dataclass
+class Sentence:
+    text: str
+    tokens: int
+    page: int
+    start: int
+    end: int
+
+
+@dataclass
+class Chunk:
+    text: str
+    page: int
+    page_end: int
+    char_start: int
+    char_end: int
+
+    def metadata(self) -> dict:
+        return {
+            "text": self.text,
+            "page": self.page,
+            "page_end": self.page_end,
+            "char_start": self.char_start,
+            "char_end": self.char_end,
+        }
+
+
+def split_sentences(text: str):
+    """
+    Yield (start, end) character spans of the sentences in `text`.
+    """
+    position = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        if boundary.start() > position:
+            yield position, boundary.start()
+        position = boundary.end()
+    if position < len(text):
+        yield position, len(text)
+
+
+class TokenChunker:
+    """
+    Sentence-aligned chunker sized in embedder tokens.
+
+    Pages are fed in order; each one is split into sentences and tokenized
+    in a single batched tokenizer call. Sentences are packed greedily until
+    the next one would overflow `max_tokens`, and the trailing sentences
+    worth up to `overlap_tokens` are carried into the next chunk. Sentences
+    longer than the budget are cut at token boundaries. Every sentence is
+    tokenized once, so the whole pass is linear in the document length.
+
+    Character offsets are positions in the document formed by joining the
+    pages with a newline, and pages are numbered from 0.
+    """
+
+    def __init__(self, tokenizer, max_tokens: int, overlap_tokens: int):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self._pending = []
+        self._pending_tokens = 0
+        self._has_new = False
+        self._offset = 0
+
+    def _sentences(self, page: int, text: str):
+        spans = [(start, end) for start, end in split_sentences(text) if text[start:end].strip()]
+        if not spans:
+            return []
+        encoded = self.tokenizer(
+            [text[start:end] for start, end in spans],
+            add_special_tokens=False,
+            return_offsets_mapping=True
+        )
+        sentences = []
+        for (start, end), offsets in zip(spans, encoded["offset_mapping"]):
+            if len(offsets) <= self.max_tokens:
+                sentences.append(Sentence(text[start:end].strip(), len(offsets), page, self._offset + start, self._offset + end))
+                continue
+            # Cut an over-long sentence into budget-sized pieces along token boundaries
+            for piece in range(0, len(offsets), self.max_tokens):
+                window = offsets[piece:piece + self.max_tokens]
+                piece_start, piece_end = start + window[0][0], start + window[-1][1]
+                sentences.append(Sentence(
+                    text[piece_start:piece_end].strip(), len(window), page,
+                    self._offset + piece_start, self._offset + piece_end
+                ))
+        return sentences
+
+    def _emit(self) -> Chunk:
+        sentences = self._pending
+        chunk = Chunk(
+            text=" ".join(sentence.text for sentence in sentences),
+            page=sentences[0].page,
+            page_end=sentences[-1].page,
+            char_start=sentences[0].start,
+            char_end=sentences[-1].end,
+        )
+        # Carry whole trailing sentences into the next chunk as overlap
+        carried, carried_tokens = [], 0
+        for sentence in reversed(sentences[1:]):
+            if carried_tokens + sentence.tokens > self.overlap_tokens:
+                break
+            carried.append(sentence)
+            carried_tokens += sentence.tokens
+        self._pending = carried[::-1]
+        self._pending_tokens = carried_tokens
+        self._has_new = False
+        return chunk
+
+    def feed(self, page: int, text: str):
+        """
+        Add a page of text and return the chunks it completed.
+        """
+        chunks = []
+        for sentence in self._sentences(page, text):
+            if self._has_new and self._pending_tokens + sentence.tokens > self.max_tokens:
+                chunks.append(self._emit())
+            # The carried overlap must still leave room for the new sentence
+            while not self._has_new and self._pending and self._pending_tokens + sentence.tokens > self.max_tokens:
+                self._pending_tokens -= self._pending.pop(0).tokens
+            self._pending.append(sentence)
+            self._pending_tokens += sentence.tokens
+            self._has_new = True
+        self._offset += len(text) + 1
+        return chunks
+
+    def finish(self):
+        """
+        Flush the final, partially filled chunk.
+        """
+        if not self._has_new:
+            return []
+        chunk = self._emit()
+        self._pending, self._pending_tokens = [], 0
+        return [chunk]
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import Config
+from common.registry import registry
+from common.retrieval import corpus
+from .chunk_registry import (
+    delete_document_vectors, delete_in_batches, flush_indexes, load_chunk_entry, roll_back_pending, save_chunk_ids
+)
+from .utils import ingest_pdf
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = (
+    "id", "filename", "path", "content_hash", "status", "page_count", "pages_done", "chunks_done",
+    "checkpoint", "timings", "error", "created_at", "updated_at"
+)
+
+
+class JobQueue:
+    """
+    Persistent queue of PDF ingestion jobs in a SQLite table.
+
+    Jobs move queued -> running -> done/failed. A running job refreshes its
+    `updated_at` heartbeat on every progress report; jobs whose heartbeat is
+    older than the lease (their worker died) are handed out again and resume
+    from their last chunk checkpoint. The file is safe to share between the
+    workers of one host.
+    """
+
+    def __init__(self, path: str, lease_seconds: float):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connection(self):
+        # Called with self._lock held; the file is opened on first use, not at import
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, filename TEXT NOT NULL, path TEXT NOT NULL, content_hash TEXT, status TEXT NOT NULL, "
+                "page_count INTEGER, pages_done INTEGER NOT NULL DEFAULT 0, "
+                "chunks_done INTEGER NOT NULL DEFAULT 0, checkpoint INTEGER NOT NULL DEFAULT 0, "
+                "timings TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            if "content_hash" not in columns:
+                # Queue files created before jobs carried the upload's content hash
+                db.execute("ALTER TABLE jobs ADD COLUMN content_hash TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._db = db
+        return self._db
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job["timings"] = json.loads(job["timings"]) if job["timings"] else None
+        return job
+
+    def enqueue(self, filename: str, path: str, content_hash: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT INTO jobs (id, filename, path, content_hash, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, filename, path, content_hash, now, now)
+            )
+        return job_id
+
+    def claim(self):
+        """
+        Atomically take the oldest queued job, or a running job whose lease expired.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            # BEGIN IMMEDIATE takes the write lock up front so two processes can't claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs "
+                    "WHERE status = 'queued' OR (status = 'running' AND updated_at < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (now - self.lease_seconds,)
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (now, row[0])
+                    )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return self._row(row)
+
+    def progress(self, job_id: str, pages_done: int, page_count: int, chunks_done: int, checkpoint=None):
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "UPDATE jobs SET pages_done = ?, page_count = ?, chunks_done = ?, "
+                "checkpoint = COALESCE(?, checkpoint), updated_at = ? WHERE id = ?",
+                (pages_done, page_count, chunks_done, checkpoint, time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, chunks_done: int, timings: dict):
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "UPDATE jobs SET status = 'done', chunks_done = ?, checkpoint = ?, pages_done = page_count, "
+                "timings = ?, updated_at = ? WHERE id = ?",
+                (chunks_done, chunks_done, json.dumps(timings), time.time(), job_id)
+            )
+
+    def release(self, job_id: str):
+        """
+        Put a running job back in the queue; it resumes from its last checkpoint.
+        """
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+
+    def get(self, job_id: str):
+        with self._lock:
+            db = self._connection()
+            row = db.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row(row)
+
+    def active_for(self, filename: str, content_hash: str):
+        """
+        Return the queued or running job for `filename` or for the same content, if any.
+        """
+        with self._lock:
+            db = self._connection()
+            row = db.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs "
+                "WHERE (filename = ? OR content_hash = ?) AND status IN ('queued', 'running') "
+                "ORDER BY created_at LIMIT 1",
+                (filename, content_hash)
+            ).fetchone()
+        return self._row(row)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class IngestWorkers:
+    """
+    Pool of asyncio tasks that drain the job queue, running at most
+    `concurrency` ingests at a time in this process.
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int, poll_seconds: float):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """
+        Wake idle workers right away instead of waiting for the next poll.
+        """
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _process(self, job):
+        async def on_progress(pages_done, page_count, chunks_done, checkpoint):
+            await asyncio.to_thread(self.queue.progress, job["id"], pages_done, page_count, chunks_done, checkpoint)
+
+        try:
+            store = await registry.get_vector_store()
+            filename = job["filename"]
+            entry = await load_chunk_entry(filename)
+            indexed = entry is not None and 'vector_ids' in entry
+            if not indexed and job["checkpoint"] == 0 and await registry.document_repository.exists(filename):
+                # An earlier version indexed before the chunk registry: its ids are unknown, so clear it first
+                await delete_document_vectors(store, filename)
+            layout, upserted, timings = await ingest_pdf(
+                job["path"], filename, store,
+                start_chunk=job["checkpoint"], known_entry=entry, on_progress=on_progress
+            )
+            chunk_count = len(layout['vector_ids'])
+            # Ids of chunks whose text is gone from the new version
+            kept = set(layout['vector_ids'])
+            stale = [vector_id for vector_id in (entry or {}).get('vector_ids', []) if vector_id not in kept]
+            if stale:
+                await asyncio.to_thread(delete_in_batches, store, stale)
+                await asyncio.to_thread(flush_indexes, store)
+            await save_chunk_ids(filename, layout['vector_ids'], layout['chunk_hashes'], layout['chunk_placements'])
+            await registry.document_repository.record_indexed(filename, job["content_hash"])
+            corpus.bump()
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back so the next worker resumes from its checkpoint
+            self.queue.release(job["id"])
+            raise
+        except Exception as error:
+            logger.exception("Ingest job %s for %s failed", job["id"], job["filename"])
+            # Failed jobs aren't retried (the upload is removed below), so undo what this one wrote
+            try:
+                removed = await roll_back_pending(await registry.get_vector_store(), job["filename"])
+                logger.info("Rolled back ingest job %s: removed %d vectors", job["id"], removed)
+            except Exception:
+                logger.exception("Rolling back ingest job %s failed", job["id"])
+            await asyncio.to_thread(self.queue.fail, job["id"], str(error) or type(error).__name__)
+        else:
+            await asyncio.to_thread(self.queue.finish, job["id"], chunk_count, timings)
+            logger.info(
+                "Indexed %d chunks from %s (%d embedded, %d reused, %d stale removed): %s",
+                chunk_count, job["filename"], upserted, chunk_count - upserted, len(stale),
+                ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items())
+            )
+        if os.path.exists(job["path"]):
+            os.remove(job["path"])
+
+
+job_queue = JobQueue(Config.INGEST_QUEUE_PATH, Config.INGEST_LEASE_SECONDS)
+ingest_workers = IngestWorkers(job_queue, Config.INGEST_CONCURRENCY, Config.INGEST_POLL_SECONDS)
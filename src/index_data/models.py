@@ -1,11 +1,22 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class DocumentsResponse(BaseModel):
     documents: List[str]
 
 class IndexPDFResponse(BaseModel):
     message: str
+    job_id: Optional[str] = None
+
+class IndexJobResponse(BaseModel):
+    id: str
+    filename: str
+    status: str
+    page_count: Optional[int] = None
+    pages_done: int
+    chunks_done: int
+    timings: Optional[Dict[str, float]] = None
+    error: Optional[str] = None
 
 class DeletePDFRequest(BaseModel):
     filename: str
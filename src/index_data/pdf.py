@@ -0,0 +1,15 @@
+import PyPDF2
+
+# Kept free of heavy imports: this module is loaded by every PDF worker process.
+
+
+def count_pages(path: str) -> int:
+    return len(PyPDF2.PdfReader(path).pages)
+
+
+def extract_page_range(path: str, start: int, stop: int):
+    """
+    Extract the text of pages [start, stop) from the PDF at `path`.
+    """
+    reader = PyPDF2.PdfReader(path)
+    return [reader.pages[number].extract_text() or "" for number in range(start, stop)]
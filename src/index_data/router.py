@@ -1,102 +1,75 @@
-from pymongo.mongo_client import MongoClient
-from config import Config
-from pymongo.server_api import ServerApi
 from fastapi import APIRouter, Query
-from .models import DocumentsResponse, IndexPDFResponse, DeletePDFRequest, SelectPDFsRequest
-from .utils import extract_text_from_pdf, chunk_text, embed_text, get_list_of_pdfs
+from .models import DocumentsResponse, IndexPDFResponse, IndexJobResponse, DeletePDFRequest, SelectPDFsRequest
+from .chunk_registry import delete_document_vectors
+from .jobs import job_queue, ingest_workers
+from .utils import spool_upload
 from fastapi import UploadFile, File, HTTPException
-from pinecone import Pinecone, ServerlessSpec
-from sentence_transformers import SentenceTransformer
-import uuid
+from common.registry import registry
+from common.retrieval import corpus
 from config import Config
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.get("/get_documents", response_model=DocumentsResponse)
 async def get_documents():
-    client = MongoClient(Config.MONGODB_URI, server_api=ServerApi('1'))
-    documents = client['fyp']['documents']
-
-    return DocumentsResponse(documents=[doc['name'] for doc in documents.find({}, {'name': 1})])
+    return DocumentsResponse(documents=await registry.document_repository.names())
 
 @router.post("/index_pdf", response_model=IndexPDFResponse)
 async def index_pdf(file: UploadFile = File(...)):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    pc = Pinecone(api_key=Config.PINECONE_API_KEY)
     # Validate file is PDF
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail='File must be a PDF')
     
-    if file.filename in get_list_of_pdfs():
-        return IndexPDFResponse(message="File already indexed")
-    
-    file_content = extract_text_from_pdf(file)
-    
-    # Chunk the text
-    chunks = chunk_text(file_content)
-    
-    # Create or connect to the index
-    if 'fyp-context' not in [index['name'] for index in pc.list_indexes()]:
-        pc.create_index(
-            name='fyp-context',
-            dimension=384,
-            metric='cosine',
-            spec=ServerlessSpec(
-                cloud='aws',
-                region='us-east-1'
-            )
-        )
-    index = pc.Index('fyp-context')
+    # Spool to the persistent upload directory so a queued job survives a restart
+    path, content_hash = await asyncio.to_thread(spool_upload, file, Config.INGEST_SPOOL_DIR)
 
-    for i, chunk in enumerate(chunks):
-        embedding = embed_text(chunk)
-        index.upsert([(str(uuid.uuid4()), embedding, {"text": chunk, "filename": file.filename, "chunk_id": i})])
-    
-    # Store the file name in MongoDB
-    client = MongoClient(Config.MONGODB_URI, server_api=ServerApi('1'))
-    documents = client['fyp']['documents']
-    documents.insert_one({'name': file.filename}, {'selected': False})
-    
-    return IndexPDFResponse(message=f"Indexed {len(chunks)} chunks from {file.filename}")
+    # Documents are identified by content: a renamed copy is not indexed again,
+    # while a new version under an existing name is re-indexed incrementally
+    existing = await registry.document_repository.find_by_hash(content_hash)
+    if existing is not None:
+        await asyncio.to_thread(os.remove, path)
+        if existing == file.filename:
+            return IndexPDFResponse(message="File already indexed")
+        return IndexPDFResponse(message=f"File already indexed as {existing}")
 
+    active_job = await asyncio.to_thread(job_queue.active_for, file.filename, content_hash)
+    if active_job is not None:
+        await asyncio.to_thread(os.remove, path)
+        return IndexPDFResponse(message="File is already being indexed", job_id=active_job["id"])
 
-@router.post('/delete_pdf')
-async def delete_pdf(request: DeletePDFRequest):
-    pc = Pinecone(api_key=Config.PINECONE_API_KEY)
-    index = pc.Index('fyp-context')
+    job_id = await asyncio.to_thread(job_queue.enqueue, file.filename, path, content_hash)
+    ingest_workers.notify()
+
+    return IndexPDFResponse(message=f"Queued {file.filename} for indexing", job_id=job_id)
 
-    query_response = index.query(
-        vector=[0] * 384,  # dummy vector for querying
-        filter={"filename": request.filename},
-        top_k=10000,
-        include_metadata=True
-    )
+@router.get("/index_jobs/{job_id}", response_model=IndexJobResponse)
+async def get_index_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return IndexJobResponse(**job)
 
-    vector_ids = [match.id for match in query_response.matches]
-    if vector_ids:
-        index.delete(ids=vector_ids)
+
+@router.post('/delete_pdf')
+async def delete_pdf(request: DeletePDFRequest):
+    store = await registry.get_vector_store()
+    await delete_document_vectors(store, request.filename)
 
     # Delete from MongoDB
-    client = MongoClient(Config.MONGODB_URI, server_api=ServerApi('1'))
-    documents = client['fyp']['documents']
-    result = documents.delete_one({'name': request.filename})
+    deleted_count = await registry.document_repository.delete(request.filename)
+    corpus.invalidate()
     
-    return {"message": f"Deleted {request.filename}", "deleted_count": result.deleted_count}
+    return {"message": f"Deleted {request.filename}", "deleted_count": deleted_count}
 
 @router.post('/select_pdfs')
 async def select_pdfs(request: SelectPDFsRequest):
-    client = MongoClient(Config.MONGODB_URI, server_api=ServerApi('1'))
-    documents = client['fyp']['documents']
-    documents.update_many(
-        {'name': {'$nin': request.filenames}},
-        {'$set': {'selected': False}}
-    )
-    documents.update_many(
-    {'name': {'$in': request.filenames}}, 
-    {'$set': {'selected': True}}
-    )
+    await registry.document_repository.set_selection(request.filenames)
+    corpus.set_selected(request.filenames)
     return {"message": f"Selected {len(request.filenames)} PDFs"}
     
 
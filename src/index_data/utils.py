@@ -1,53 +1,210 @@
+import asyncio
+import hashlib
 import os
-import PyPDF2
-from pinecone import Pinecone, ServerlessSpec
-from sentence_transformers import SentenceTransformer
-import textwrap
-import uuid
+import tempfile
+import time
+from collections import deque
 from config import Config
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+from common.registry import registry
 from fastapi import UploadFile
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from .chunk_registry import (
+    chunk_hash, chunk_placement, chunk_vector_id, document_key, flush_indexes, record_pending
+)
+from .chunking import TokenChunker
+from .pdf import count_pages, extract_page_range
 
-# Initialize the sentence transformer model
-model = SentenceTransformer('all-MiniLM-L6-v2')
-pc = Pinecone(api_key=Config.PINECONE_API_KEY)
-client = MongoClient(Config.MONGODB_URI, server_api=ServerApi('1'))
-documents = client['fyp']['documents']
+def spool_upload(file: UploadFile, directory: str = None):
+    """
+    Copy an upload to a temporary file on disk (in `directory` if given),
+    hashing it on the way. Returns the path and the sha256 of the content;
+    the caller is responsible for removing the file.
+    """
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", dir=directory, delete=False) as spooled:
+        file.file.seek(0)
+        while block := file.file.read(1024 * 1024):
+            digest.update(block)
+            spooled.write(block)
+    return spooled.name, digest.hexdigest()
+
+async def pdf_page_count(path: str) -> int:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(registry.pdf_executor, count_pages, path)
 
-def extract_text_from_pdf(file : UploadFile):
+async def iter_pdf_pages(path: str, page_count: int, pages_per_task=Config.PDF_PAGES_PER_TASK, window=Config.PDF_WINDOW_TASKS):
     """
-    Extract text from a PDF file.
+    Yield (page_number, text) for every page of the PDF at `path`, in order.
+
+    Page ranges are extracted on the PDF process pool with at most `window`
+    ranges in flight, so memory is bounded by a window of pages rather
+    than the whole document.
     """
-    file_content = file.file.read()
-    pdf_file = BytesIO(file_content)
-    reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    return text
+    loop = asyncio.get_running_loop()
+    executor = registry.pdf_executor
+    ranges = deque(
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    )
+    in_flight = deque()
+    while ranges or in_flight:
+        while ranges and len(in_flight) < window:
+            start, stop = ranges.popleft()
+            in_flight.append((start, loop.run_in_executor(executor, extract_page_range, path, start, stop)))
+        start, future = in_flight.popleft()
+        for offset, text in enumerate(await future):
+            yield start + offset, text
 
-def chunk_text(text, chunk_size=1000, overlap=100):
+async def embed_texts(texts, batch_size=Config.EMBED_BATCH_SIZE):
     """
-    Split the text into overlapping chunks.
+    Create embeddings for a list of texts, one encode call per batch.
     """
-    chunks = textwrap.wrap(text, chunk_size)
-    overlapped_chunks = []
-    for i, chunk in enumerate(chunks):
-        if i == 0:
-            overlapped_chunks.append(chunk)
-        else:
-            overlapped_chunks.append(chunks[i-1][-overlap:] + chunk)
-    return overlapped_chunks
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        embeddings.extend((await registry.embed(batch, batch_size=batch_size)).tolist())
+    return embeddings
 
-def embed_text(text):
+def upsert_vectors(store, vectors, batch_size=Config.UPSERT_BATCH_SIZE, max_workers=Config.UPSERT_MAX_WORKERS):
+    """
+    Upsert (id, values, metadata) tuples in sized batches with bounded parallelism.
     """
-    Create an embedding for the given text.
+    batches = [vectors[start:start + batch_size] for start in range(0, len(vectors), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() forces every batch through so upsert errors are raised here
+        list(executor.map(store.upsert, batches))
+    return len(batches)
+
+def create_chunker() -> TokenChunker:
+    """
+    Build a chunker sized to what the embedder actually sees: anything past
+    max_seq_length (less the [CLS]/[SEP] tokens) would be truncated.
+    """
+    embedder = registry.embedder
+    return TokenChunker(
+        embedder.tokenizer,
+        max_tokens=min(Config.CHUNK_MAX_TOKENS, embedder.max_seq_length - 2),
+        overlap_tokens=Config.CHUNK_OVERLAP_TOKENS
+    )
+
+async def ingest_pdf(path: str, filename: str, store, start_chunk: int = 0, known_entry=None, on_progress=None):
     """
-    return model.encode(text).tolist()
+    Stream a spooled PDF through extraction, chunking, embedding and upserts
+    into both the vector store and the lexical index.
+
+    When re-indexing a new version of a document, `known_entry` is its chunk
+    registry entry. A chunk whose text hash appears in it keeps the vector
+    id (and vector) it was indexed under; if it moved, only its position and
+    offsets are updated. Other chunks are embedded under fresh ids, numbered
+    after the ones in the entry. The ids depend only on the entry and the
+    chunking, both deterministic, so an interrupted ingest can be resumed
+    by passing the number of chunks already handled as `start_chunk`.
+    `on_progress` is awaited after every batch with (pages_done, page_count,
+    chunks_done, checkpoint); checkpoint is set to the durable chunk count
+    every INGEST_CHECKPOINT_CHUNKS chunks, after the indexes have been flushed.
+
+    Returns the vector id, hash and placement of every chunk of the
+    document by position, the number of chunks actually embedded and
+    upserted, and the time spent in each stage.
+    """
+    timings = {'extract': 0.0, 'chunk': 0.0, 'embed': 0.0, 'upsert': 0.0}
+    doc_key = document_key(filename)
+    chunker = create_chunker()
+    lexical_index = await registry.get_lexical_index()
+    known_entry = known_entry or {}
+    known_ids = known_entry.get('vector_ids', [])
+    known_placements = known_entry.get('chunk_placements', [])
+    # Old positions per text hash, in order, so repeated chunks are matched up one to one
+    reusable = {}
+    for position, digest in enumerate(known_entry.get('chunk_hashes', [])):
+        reusable.setdefault(digest, deque()).append(position)
+    next_id = max((int(vector_id.rsplit("#", 1)[1]) + 1 for vector_id in known_ids), default=0)
+    layout = {'vector_ids': [], 'chunk_hashes': [], 'chunk_placements': []}
+    pending = []
+    chunks_done = start_chunk
+    last_checkpoint = start_chunk
+    upserted = 0
+    pages_done = 0
+
+    async def index_batch(batch):
+        nonlocal chunks_done, last_checkpoint, upserted
+        metadata = {
+            position: {**chunk.metadata(), "filename": filename, "chunk_id": position, "doc_key": doc_key}
+            for position, chunk, _, _ in batch
+        }
+        fresh = [(position, chunk) for position, chunk, _, reused in batch if not reused]
+        started = time.perf_counter()
+        embeddings = await embed_texts([chunk.text for _, chunk in fresh]) if fresh else []
+        timings['embed'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        # Deterministic ids make a resumed run overwrite, not duplicate, what it already upserted
+        vectors = [
+            (layout['vector_ids'][position], embedding, metadata[position])
+            for (position, _), embedding in zip(fresh, embeddings)
+        ]
+        moved = [(vector_id, metadata[position]) for position, _, vector_id, reused in batch if reused]
+        # Written ahead so a failed ingest can be rolled back, whichever run got how far
+        await record_pending(filename, [vector_id for vector_id, _, _ in vectors], [vector_id for vector_id, _ in moved])
+        await asyncio.to_thread(upsert_vectors, store, vectors)
+        if moved:
+            await asyncio.to_thread(store.update_metadata, moved)
+        await asyncio.to_thread(
+            lexical_index.add, [(vector_id, metadata) for vector_id, _, metadata in vectors] + moved
+        )
+        timings['upsert'] += time.perf_counter() - started
+        upserted += len(vectors)
+        chunks_done = batch[-1][0] + 1
+        if on_progress is not None:
+            checkpoint = None
+            if chunks_done - last_checkpoint >= Config.INGEST_CHECKPOINT_CHUNKS:
+                await asyncio.to_thread(flush_indexes, store)
+                checkpoint = last_checkpoint = chunks_done
+            await on_progress(pages_done, page_count, chunks_done, checkpoint)
+
+    def collect(chunks):
+        nonlocal next_id
+        for chunk in chunks:
+            position = len(layout['vector_ids'])
+            digest, placement = chunk_hash(chunk), chunk_placement(chunk)
+            previous = reusable[digest].popleft() if reusable.get(digest) else None
+            if previous is None:
+                vector_id = chunk_vector_id(doc_key, next_id)
+                next_id += 1
+            else:
+                vector_id = known_ids[previous]
+            layout['vector_ids'].append(vector_id)
+            layout['chunk_hashes'].append(digest)
+            layout['chunk_placements'].append(placement)
+            # Skip chunks a previous, interrupted run already handled and
+            # unchanged chunks that stayed where they were
+            if position < start_chunk:
+                continue
+            if previous == position and previous < len(known_placements) and known_placements[previous] == placement:
+                continue
+            pending.append((position, chunk, vector_id, previous is not None))
+
+    page_count = await pdf_page_count(path)
+    pages = iter_pdf_pages(path, page_count)
+    while True:
+        started = time.perf_counter()
+        page = await anext(pages, None)
+        timings['extract'] += time.perf_counter() - started
+        if page is None:
+            break
+
+        started = time.perf_counter()
+        collect(await asyncio.to_thread(chunker.feed, *page))
+        timings['chunk'] += time.perf_counter() - started
+        pages_done = page[0] + 1
+        while len(pending) >= Config.EMBED_BATCH_SIZE:
+            batch, pending[:] = pending[:Config.EMBED_BATCH_SIZE], pending[Config.EMBED_BATCH_SIZE:]
+            await index_batch(batch)
 
-def get_list_of_pdfs():
-    client = MongoClient(Config.MONGODB_URI, server_api=ServerApi('1'))
-    documents = client['fyp']['documents']
-    return [doc['name'] for doc in documents.find({}, {'name': 1})]
+    collect(chunker.finish())
+    if pending:
+        await index_batch(pending)
+    await asyncio.to_thread(flush_indexes, store)
+    return layout, upserted, timings